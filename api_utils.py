@@ -1,31 +1,58 @@
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-from location import weatherloc
+from location import DEFAULT_ZIPCODE, weatherloc
 import pytz
 from weathercode import weatherCode
 from config import OPENAI_API_KEY, TOMORROW_IO_API_KEY
-import pickle
+from icons import DEFAULT_ICON, icon_index, missing_icon_codes
+import json
+from cache import ttlCache
+import transport
+
+# orjson is optional; it decodes large forecast payloads several times faster
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 SINGLE_ICONS = [1001, 2100, 2000, 4000, 4200, 4001, 4201, 5001, 5100, 5000, 5101, 7103, 7106, 7117, 7115, 7105, 7101,
                 7000, 7102, 6201, 6001, 6200, 6000, 5112, 5114, 5108, 5110, 5122, 8000]
 
-#Importing png files scraped from Github with scrape_icons.py
-with open('data.pkl', 'rb') as f:
-    loaded_data = pickle.load(f)
-    png_files = loaded_data
+# Integer-valued fields of the Tomorrow.io timelines; every other numeric field is a float measurement
+CODE_FIELDS = {"weatherCode", "weatherCodeMax", "weatherCodeMin"}
 
-def api_call(time_period="forecast", time_step="1h", units="imperial", wlo=weatherloc("08057")):
+# Seconds each kind of Tomorrow.io response stays fresh; realtime conditions change faster than the forecast
+API_CACHE_TTL = {"now": 300, "forecast": 1800, "historical": 3600}
+# Seconds after expiry during which a response is still served while api_call fetches it again in the background
+API_STALE_TTL = {"now": 300, "forecast": 1800, "historical": 3600}
+# Coordinates are rounded to ~1 km so nearby zipcodes share cache entries
+COORD_DIGITS = 2
+api_cache = ttlCache(maxsize=512)
+API_HEADERS = {"accept": "application/json"}
+
+# Shared pool for the concurrent network stages of a dashboard refresh
+fetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="weather-fetch")
+
+# Every code process_data can produce: single-icon codes only ever get the day suffix
+_BASE_CODES = {int(code) // 10 for code in weatherCode if code != "0"}
+PROCESSED_CODES = sorted({base * 10 for base in _BASE_CODES} |
+                         {base * 10 + 1 for base in _BASE_CODES if base not in SINGLE_ICONS})
+
+_missing_icons = missing_icon_codes(PROCESSED_CODES)
+if _missing_icons:
+    print(f"No icon for weather codes {_missing_icons}; falling back to their day icon or {DEFAULT_ICON}")
+
+def build_request(time_period, time_step, units, wlo):
     """
-    Makes an API call to the Tomorrow.io service to retrieve weather data for a specific location.
-    The type of weather data, its granularity, and the measurement units can be customized via
-    the function's parameters.
+    Builds the Tomorrow.io url for a request together with its cache key and TTL. Shared by the sync api_call
+    and the async one in async_api.
 
-    :param time_period:
-    :param time_step:
-    :param units:
-    :type wlo: weatherloc
+    :return: (url, cache key, ttl in seconds)
     """
-    latitude, longitude = wlo.lat, wlo.lng
+    latitude, longitude = round(wlo.lat, COORD_DIGITS), round(wlo.lng, COORD_DIGITS)
 
     # customizing request based on time period of interest
     if time_period == "now":
@@ -39,26 +66,106 @@ def api_call(time_period="forecast", time_step="1h", units="imperial", wlo=weath
 
         url = f"{endpoint}location={latitude},{longitude}&timesteps={time_step}&units={units}&apikey={TOMORROW_IO_API_KEY}"
 
-    headers = {"accept": "application/json"}
+    key = (time_period, None if time_period == "now" else time_step, units, latitude, longitude)
+    return url, key, API_CACHE_TTL.get(time_period, API_CACHE_TTL["forecast"])
+
+
+def api_call(time_period="forecast", time_step="1h", units="imperial", wlo=None):
+    """
+    Makes an API call to the Tomorrow.io service to retrieve weather data for a specific location.
+    The type of weather data, its granularity, and the measurement units can be customized via
+    the function's parameters.
 
-    response = requests.get(url, headers=headers)
+    :param time_period:
+    :param time_step:
+    :param units:
+    :type wlo: weatherloc, defaults to DEFAULT_ZIPCODE
+    """
+    if wlo is None:
+        wlo = weatherloc(DEFAULT_ZIPCODE)
+    url, key, ttl = build_request(time_period, time_step, units, wlo)
+
+    # Responses are shared through api_cache; failed calls are returned but never cached, and an expired
+    # response is served within its stale window while fetch_executor revalidates it
+    response = api_cache.get_or_fetch(key, lambda: transport.get(url, headers=API_HEADERS), ttl=ttl,
+                                      should_cache=is_cacheable, stale_ttl=stale_ttl(time_period),
+                                      revalidate=fetch_executor.submit)
 
     return response
 
 
-def convert_to_df(json_data):
+def api_refresh(time_period="forecast", time_step="1h", units="imperial", wlo=None):
+    """
+    Fetches a response again and replaces its api_cache entry even if it is still fresh. Used by the background
+    refresher so visitors never wait for an expired entry; an api_call for the same key joins the running fetch.
+
+    :type wlo: weatherloc
+    :return: response object
+    """
+    url, key, ttl = build_request(time_period, time_step, units, wlo)
+    return api_cache.refresh(key, lambda: transport.get(url, headers=API_HEADERS), ttl=ttl,
+                             should_cache=is_cacheable, stale_ttl=stale_ttl(time_period))
+
+
+def is_cacheable(response):
+    return response.ok
+
+
+def stale_ttl(time_period):
+    return API_STALE_TTL.get(time_period, API_STALE_TTL["forecast"])
+
+
+def submit_timed(timings, stage, fn, *args, **kwargs):
     """
-    Converts json output into Pandas DataFrame
+    Runs fn(*args, **kwargs) on fetch_executor and records its wall time in seconds under timings[stage]
+
+    :return: Future of fn's result
+    """
+    def run():
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings[stage] = time.perf_counter() - start
+
+    return fetch_executor.submit(run)
+
+
+def convert_to_df(json_data, timeline="hourly"):
+    """
+    Converts json output into Pandas DataFrame, building one typed NumPy column per field.
+    Measurements are float32, weather codes int16 and time a UTC datetime64; the payload is not modified.
+
+    :param json_data: decoded forecast response, or its raw bytes/str
+    :param timeline: which timeline to convert: "minutely", "hourly" or "daily"
+    :return: df
     """
-    timelines = json_data['timelines']
-    hourly = timelines['hourly']
+    if isinstance(json_data, (bytes, bytearray, str)):
+        json_data = json_loads(json_data)
+
+    entries = json_data['timelines'][timeline]
+    values = [entry['values'] for entry in entries]
+
+    # Union of the fields in order of first appearance, since some entries omit fields
+    fields = dict.fromkeys(field for value in values for field in value)
+
+    columns = {}
+    for field in fields:
+        raw = [value.get(field) for value in values]
+        sample = next((x for x in raw if x is not None), None)
+
+        if isinstance(sample, str):
+            # e.g. sunriseTime in the daily timeline
+            columns[field] = pd.to_datetime(raw, utc=True) if field.endswith("Time") else np.array(raw, dtype=object)
+        elif field in CODE_FIELDS and None not in raw:
+            columns[field] = np.array(raw, dtype=np.int16)
+        else:
+            # missing measurements become NaN
+            columns[field] = np.array(raw, dtype=np.float32)
+
+    columns['time'] = pd.to_datetime([entry['time'] for entry in entries], utc=True)
 
-    rows = []
-    for hour in hourly:
-        row = hour['values']
-        row['time'] = hour['time']
-        rows.append(row)
-    df = pd.DataFrame(rows)
+    df = pd.DataFrame(columns)
     return df
 
 
@@ -72,7 +179,7 @@ def convert_to_local_time(utc_time, current_timezone):
     return local_dt.time()
 
 
-def process_data(df, wlo=weatherloc("08057")):
+def process_data(df, wlo=None):
     """
     Processes a DataFrame containing weather data by converting timestamps to local time,
      determining sunrise and sunset times, and modifying weather codes based on the time of day.
@@ -81,24 +188,24 @@ def process_data(df, wlo=weatherloc("08057")):
     :param wlo: An object of type weatherloc that contains the latitude, longitude, and timezone of the location
     :return: modified DataFrame (df) with additional columns and processed weather codes
     """
-    df["time"] = pd.to_datetime(df["time"])
-
-    current_timezone = wlo.timezone
-    sunrise, sunset = wlo.get_sunrise_sunset()
-
-    local_sunrise = convert_to_local_time(sunrise, current_timezone)
-    local_sunset = convert_to_local_time(sunset, current_timezone)
-
-    df["local_time"] = df.apply(lambda row: convert_to_local_time(row["time"], current_timezone), axis=1)
-
-    for index, row in df.iterrows():
-        if row["weatherCode"] in SINGLE_ICONS:
-            df.loc[index, "weatherCode"] = int(str(row["weatherCode"]) + "0")
-        else:
-            if (row["local_time"] < local_sunrise) or (row["local_time"] > local_sunset):
-                df.loc[index, "weatherCode"] = int(str(row["weatherCode"]) + "1")
-            else:
-                df.loc[index, "weatherCode"] = int(str(row["weatherCode"]) + "0")
+    if wlo is None:
+        wlo = weatherloc(DEFAULT_ZIPCODE)
+    times = pd.to_datetime(df["time"], utc=True)
+    local_times = times.dt.tz_convert(wlo.timezone)
+
+    # Each row is compared against the sun times of its own local day, so multi-day forecasts stay correct
+    local_dates = local_times.dt.normalize().dt.tz_localize(None)
+    sun_times = wlo.get_sun_times(local_dates)
+    sunrise = local_dates.map(sun_times["sunrise"])
+    sunset = local_dates.map(sun_times["sunset"])
+
+    # Codes with a single icon always get the day suffix (0); the rest get 1 at night
+    codes = df["weatherCode"].to_numpy(dtype=np.int64)
+    is_night = ((times < sunrise) | (times > sunset)).to_numpy() & ~np.isin(codes, SINGLE_ICONS)
+
+    df["time"] = times
+    df["local_time"] = local_times
+    df["weatherCode"] = codes * 10 + is_night
     return df
 
 
@@ -110,23 +217,15 @@ def add_desc(df):
     :return: df
     """
     if 'weatherCode_desc' not in df.columns:
-        for index, row in df.iterrows():
-            code = row["weatherCode"]
-            df["weatherCode_desc"] = weatherCode[str(code)]
+        df["weatherCode_desc"] = df["weatherCode"].astype(str).map(weatherCode)
     return df
 
 
 def get_image_names(df):
     """
-    Creates a column of image names that will link each row of data to the appropriate weather icon
+    Creates a column of image names that will link each row of data to the appropriate weather icon,
+    using the code -> icon index built when the icon pack loads
     :param df:
-    :return:
+    :return: Series of icon file names
     """
-    image_names = []
-    for code in df["weatherCode"]:
-        result = [key for key, value in png_files.items() if key.startswith(str(code))]
-        if result:
-            image_names.append(result[0])
-        else:
-            image_names.append("10000_clear_small.png")
-    return image_names
+    return df["weatherCode"].map(icon_index).fillna(DEFAULT_ICON)
@@ -0,0 +1,142 @@
+"""
+Async counterparts of the api_utils and location I/O, built on one shared httpx.AsyncClient per event loop.
+Meant for background refreshers or an async server; Dash callbacks keep using the sync functions. The two are
+separate implementations that share request building, parsing and the response cache, whose misses coalesce
+across both.
+"""
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+
+import transport
+from api_utils import API_HEADERS, api_cache, build_request, is_cacheable, stale_ttl
+from location import DEFAULT_ZIPCODE, parse_sunrise_sunset, weatherloc
+
+# Upper bound on requests in flight at once across all coroutines of an event loop
+MAX_CONCURRENCY = 10
+
+_client = None
+_client_loop = None
+_semaphore = None
+
+
+def get_async_client():
+    """
+    Returns the shared client of the running event loop, creating it and its concurrency limit on first use
+    """
+    global _client, _client_loop, _semaphore
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        limits = httpx.Limits(max_connections=transport.POOL_SIZE, max_keepalive_connections=transport.POOL_SIZE)
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(transport.READ_TIMEOUT, connect=transport.CONNECT_TIMEOUT),
+            transport=httpx.AsyncHTTPTransport(retries=transport.MAX_RETRIES, limits=limits))
+        _client_loop = loop
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    return _client
+
+
+async def aclose():
+    """
+    Closes the shared client; the next request creates a new one
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def get(url, **kwargs):
+    """
+    Async GET with the same timeouts, retry policy, RETRY_AFTER_MAX and latency histograms as transport.get
+
+    :return: httpx.Response
+    """
+    client = get_async_client()
+    start = time.perf_counter()
+    try:
+        for attempt in range(transport.MAX_RETRIES + 1):
+            async with _semaphore:
+                response = await client.get(url, **kwargs)
+            if response.status_code not in transport.RETRY_STATUSES or attempt == transport.MAX_RETRIES:
+                return response
+
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit() and int(retry_after) > transport.RETRY_AFTER_MAX:
+                return response
+            delay = transport.BACKOFF_FACTOR * 2 ** attempt
+            # Waits outside the semaphore, so a backoff does not hold a slot other requests could use
+            await asyncio.sleep(int(retry_after) if retry_after.isdigit() else min(delay, transport.BACKOFF_MAX))
+    finally:
+        transport.record_latency(urlsplit(url).netloc, time.perf_counter() - start)
+
+
+async def api_call(time_period="forecast", time_step="1h", units="imperial", wlo=None):
+    """
+    Async version of api_utils.api_call. It shares the response cache with it, including miss coalescing and
+    serving stale responses while they are revalidated, so sync and async callers never fetch the same key twice.
+
+    :type wlo: weatherloc, defaults to DEFAULT_ZIPCODE
+    :return: requests.Response, the type api_cache holds for both paths
+    """
+    if wlo is None:
+        wlo = await asyncio.to_thread(weatherloc, DEFAULT_ZIPCODE)
+    url, key, ttl = build_request(time_period, time_step, units, wlo)
+
+    async def fetch():
+        return as_requests_response(await get(url, headers=API_HEADERS))
+
+    return await api_cache.get_or_fetch_async(key, fetch, ttl=ttl, should_cache=is_cacheable,
+                                              stale_ttl=stale_ttl(time_period), revalidate=True)
+
+
+def as_requests_response(response):
+    """
+    Copies an httpx.Response into a requests.Response, so cached responses look the same to sync and async callers
+    """
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.reason = response.reason_phrase
+    converted.headers = requests.structures.CaseInsensitiveDict(response.headers)
+    converted.url = str(response.url)
+    converted.encoding = response.encoding
+    converted._content = response.content
+    return converted
+
+
+async def get_sunrise_sunset(wlo):
+    """
+    Async version of weatherloc.get_sunrise_sunset
+
+    :return: (sunrise, sunset) as UTC Timestamps
+    """
+    response = await get(wlo.sunrise_sunset_url())
+
+    return parse_sunrise_sunset(response.json())
+
+
+async def fetch_locations(zipcodes):
+    """
+    Resolves several zipcodes concurrently. Lookups hit the location store or geocoder, so they run in threads.
+
+    :return: list of weatherloc, in the order of zipcodes
+    """
+    return await asyncio.gather(*(asyncio.to_thread(weatherloc, zipcode) for zipcode in zipcodes))
+
+
+async def fetch_weather_batch(zipcodes, units="imperial", time_step="1h"):
+    """
+    Fetches realtime and forecast data for several zipcodes at once, bounded by MAX_CONCURRENCY
+
+    :return: dict of zipcode -> (weatherloc, realtime response, forecast response)
+    """
+    locations = await fetch_locations(zipcodes)
+
+    responses = await asyncio.gather(*(
+        asyncio.gather(api_call("now", time_step, units, wlo), api_call("forecast", time_step, units, wlo))
+        for wlo in locations))
+
+    return {zipcode: (wlo, now, forecast) for zipcode, wlo, (now, forecast) in zip(zipcodes, locations, responses)}
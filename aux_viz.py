@@ -1,111 +1,177 @@
-import matplotlib
-
-matplotlib.use('Agg')
+"""
+Figures of the dashboard. matplotlib, pandas and dash are imported on first use, so importing this module and
+rendering with Plotly never pays for the raster stack.
+"""
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib.patches import Circle, Wedge, Rectangle
-from matplotlib import cm
 from io import BytesIO
-import seaborn as sns
-import pandas as pd
+import plotly.colors
 import plotly.graph_objects as go
 import base64
-import pickle
-
-# Importing png files scraped from Github with scrape_icons.py
-with open('data.pkl', 'rb') as f:
-    loaded_data = pickle.load(f)
-    png_files = loaded_data
-
-
-def get_forecast_fig(df):
-    fig = go.Figure(data=[
-        go.Scatter(x=df['temperature'].index, y=df['temperature'], mode='lines', line=dict(color='blue'),
-                   fillcolor="grey", name="Actual", legendrank=1),
-        go.Scatter(x=[df['temperature'].index[df['temperature'].idxmax()]],
-                   y=[df['temperature'].max()],
-                   text="H", textposition='top right',
-                   mode='markers', marker=dict(size=12, color='red'), name="Max", legendrank=3),
-        go.Scatter(x=[df['temperature'].index[df['temperature'].idxmin()]],
-                   y=[df['temperature'].min()],
-                   text="L", textposition='top right',
-                   mode='markers', marker=dict(size=12, color='blue'), name="Min", legendrank=4),
-        go.Scatter(x=df['temperature'].index, y=df['temperatureApparent'], mode='lines',
-                   line=dict(dash='dot', color="grey"), name="Feels Like", legendrank=2)
-    ])
+import copy
+import os
+from functools import lru_cache
+from figures import figure_pool
+from icons import DEFAULT_ICON, icon_index_for, icon_source
 
-    for index, row in df.iterrows():
-        # Get image data and add to figure
-        img_name = row['image_names']
-        byte_content = png_files.get(img_name)
-        encoded_image = base64.b64encode(byte_content).decode('utf-8')
-        data_uri = "data:image/png;base64," + encoded_image
-
-        fig.add_layout_image(
-            dict(
-                source=data_uri,
-                xref="x",
-                yref="paper",
-                x=index - .5,
-                y=1.1,
-                sizex=.8,
-                sizey=.8,
-                opacity=1,
-                layer="above"
-            )
-        )
+# Icons are drawn about 30 px wide in the forecast figure, so the 32 px variant is enough
+FIGURE_ICON_VARIANT = "32px"
 
-    fig.update_xaxes(
-        ticktext=df['local_time'],  # Convert timestamps to desired string format
-        tickvals=df['temperature'].index  # Use integer indices as actual tick values
-    )
+# Longest run of hourly icons and tick labels on the forecast x axis before they thin out to every n-th hour
+FORECAST_MAX_LABELS = 24
 
-    fig.update_layout(
-        autosize=False,
-        width=1000,
-        height=600,
-        title="24 Hour Weather Forecast",
-        xaxis_title="Local Time",
-        yaxis_title="Temperature (F°)")
+# "plotly" sends the wind rose to the browser as a figure (JSON); "png" rasterizes it with matplotlib on the server
+WIND_ROSE_RENDERER = os.environ.get("WEATHER_WIND_ROSE_RENDERER", "plotly")
 
-    return fig
+# Wind rose speed bin edges (knots, right-closed; the first bin is calm) and number of direction sectors
+SPEED_BINS = [-1, 0, 5, 10, 15, 20, 25, 30, np.inf]
+DIRECTION_SECTORS = 24
 
+# The gauge only has a handful of distinct inputs (arrow 1-4, fixed labels, colors and titles)
+GAUGE_CACHE_SIZE = 64
 
-def wind_rose_plot(df):
-    fig = go.Figure(data=go.Area(
-        r=df['windSpeed'],
-        theta=df['windDirection'],
-        marker=dict(
-            color=df['windSpeed'],
-            colorscale='Viridis',
-            showscale=True
-        ),
-        hovertemplate='Direction: %{theta}°<br>Speed: %{r} m/s',
-        name='Wind Rose'
-    ))
 
-    fig.update_layout(
-        title='Wind Rose Plot',
-        polar=dict(
-            radialaxis=dict(
-                showgrid=True,
-                tickangle=0,
-                ticksuffix=' m/s',
-                ticks='outside',
-                tickfont=dict(size=10),
-                range=[0, df['windSpeed'].max()]
-            ),
-            angularaxis=dict(
-                tickmode='array',
-                tickvals=[0, 45, 90, 135, 180, 225, 270, 315],
-                ticktext=['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW'],
-                direction='clockwise'
-            )
-        ),
-        showlegend=True
+@lru_cache(maxsize=1)
+def _forecast_template():
+    """
+    Parts of the forecast figure that are the same for every location: trace styles, legend ranks, axis titles
+    and size. Deep-copied before the per-location values are filled in.
+    """
+    return dict(
+        data=[
+            dict(type='scatter', mode='lines', line=dict(color='blue'), fillcolor="grey", name="Actual", legendrank=1),
+            dict(type='scatter', text="H", textposition='top right',
+                 mode='markers', marker=dict(size=12, color='red'), name="Max", legendrank=3),
+            dict(type='scatter', text="L", textposition='top right',
+                 mode='markers', marker=dict(size=12, color='blue'), name="Min", legendrank=4),
+            dict(type='scatter', mode='lines', line=dict(dash='dot', color="grey"), name="Feels Like", legendrank=2)
+        ],
+        layout=dict(
+            xaxis=dict(title=dict(text="Local Time")),
+            yaxis=dict(title=dict(text="Temperature (F°)")),
+            autosize=False,
+            width=1000,
+            height=600))
+
+
+def _forecast_values(df, icon_variant):
+    """
+    Per-location values of the forecast figure: temperatures, min/max positions, icon sources and tick labels
+    """
+    if icon_variant is None:
+        image_names = df['image_names'].to_numpy()
+    else:
+        image_names = df['weatherCode'].map(icon_index_for(icon_variant)).fillna(DEFAULT_ICON).to_numpy()
+
+    hours = len(df)
+    temperature = df['temperature'].to_numpy()
+
+    # Longer horizons only label and draw an icon for every step-th hour, with icons widened to match
+    step = -(-hours // FORECAST_MAX_LABELS)
+
+    return dict(
+        hours=hours,
+        step=step,
+        x=np.arange(hours),
+        temperature=temperature,
+        temperature_apparent=df['temperatureApparent'].to_numpy(),
+        i_max=temperature.argmax(),
+        i_min=temperature.argmin(),
+        sources=[icon_source(img_name) for img_name in image_names[::step]],
+        ticktext=df['local_time'].to_numpy()[::step])
+
+
+def get_forecast_fig(df, icon_variant=FIGURE_ICON_VARIANT, validate=True):
+    """
+    Builds the temperature forecast figure with a weather icon above each hour. The per-location values are filled
+    into a copy of the cached template and handed to plotly in a single call.
+
+    :param df: processed forecast rows to plot, e.g. the next 24, 48 or 120 hours
+    :param icon_variant: icon size variant to embed (e.g. "32px", "64px.webp"); None uses df['image_names']
+    :param validate: False skips plotly's property validation, most of the build time; the dict built here is
+        known to be valid
+    """
+    return _build_forecast_fig(_forecast_values(df, icon_variant), validate)
+
+
+def placeholder_forecast_fig(hours=24):
+    """
+    Forecast figure with the traces, icons and ticks of an hours-long forecast but no data, shown until the first
+    load; forecast_fig_patch fills it in
+    """
+    step = -(-hours // FORECAST_MAX_LABELS)
+    labels = len(range(0, hours, step))
+    values = dict(
+        hours=hours,
+        step=step,
+        x=np.arange(hours),
+        temperature=np.full(hours, np.nan),
+        temperature_apparent=np.full(hours, np.nan),
+        i_max=0,
+        i_min=0,
+        sources=[None] * labels,
+        ticktext=np.full(labels, "", dtype=object))
+    return _build_forecast_fig(values, validate=False)
+
+
+def _build_forecast_fig(values, validate):
+    x, step, temperature = values['x'], values['step'], values['temperature']
+    labelled = x[::step]
+
+    fig = copy.deepcopy(_forecast_template())
+    actual, high, low, feels_like = fig['data']
+    actual.update(x=x, y=temperature)
+    high.update(x=[x[values['i_max']]], y=[temperature[values['i_max']]])
+    low.update(x=[x[values['i_min']]], y=[temperature[values['i_min']]])
+    feels_like.update(x=x, y=values['temperature_apparent'])
+
+    layout = fig['layout']
+    layout['images'] = [
+        dict(
+            source=source,
+            xref="x",
+            yref="paper",
+            x=index - .5 * step,
+            y=1.1,
+            sizex=.8 * step,
+            sizey=.8,
+            opacity=1,
+            layer="above"
+        )
+        for index, source in zip(labelled, values['sources'])
+    ]
+    layout['xaxis'].update(
+        ticktext=values['ticktext'],  # Convert timestamps to desired string format
+        tickvals=labelled  # Use integer indices as actual tick values
     )
+    layout['title'] = dict(text=f"{values['hours']} Hour Weather Forecast")
 
-    return fig
+    return go.Figure(fig, _validate=validate)
+
+
+def forecast_fig_patch(df, icon_variant=FIGURE_ICON_VARIANT):
+    """
+    Partial update turning a displayed forecast figure into the one for df, for a figure of the same number of
+    hours: only the temperatures, min/max markers, tick labels and icon sources are sent to the browser.
+
+    :return: dash.Patch for the figure property of the dcc.Graph showing get_forecast_fig
+    """
+    from dash import Patch
+
+    values = _forecast_values(df, icon_variant)
+    temperature = values['temperature']
+
+    patch = Patch()
+    patch['data'][0]['y'] = temperature.tolist()
+    patch['data'][1]['x'] = [int(values['i_max'])]
+    patch['data'][1]['y'] = [float(temperature[values['i_max']])]
+    patch['data'][2]['x'] = [int(values['i_min'])]
+    patch['data'][2]['y'] = [float(temperature[values['i_min']])]
+    patch['data'][3]['y'] = values['temperature_apparent'].tolist()
+    patch['layout']['xaxis']['ticktext'] = values['ticktext'].tolist()
+    for i, source in enumerate(values['sources']):
+        patch['layout']['images'][i]['source'] = source
+
+    return patch
 
 
 def arrow_pos(uvIndex):
@@ -136,33 +202,61 @@ def rot_text(ang):
     return rotation
 
 
-def gauge(labels=['LOW', 'MEDIUM', 'HIGH', 'VERY HIGH', 'EXTREME'], colors='jet_r', arrow=1, title='', fname=False):
-    # begin with sanity checks
-    N = len(labels)
+def gauge(labels=['LOW', 'MEDIUM', 'HIGH', 'VERY HIGH', 'EXTREME'], colors='jet_r', arrow=1, title='', fname=False,
+          fmt='png'):
+    """
+    Renders the gauge as a data URI. The output only depends on the arguments, so renders are memoized:
+    after the first call for a given arrow position, labels, colors and title it is a cache lookup.
 
-    if arrow > N:
-        raise Exception("\n\nThe category ({}) is greated than the length\nof the labels ({})".format(arrow, N))
+    :param fmt: 'png', or 'svg' for a vector image with no rasterization
+    """
+    if not isinstance(colors, str):
+        colors = tuple(colors)
+    return _render_gauge(tuple(labels), colors, arrow, title, fmt)
 
+
+def _gauge_colors(colors, N):
     """
     if colors is a string, we assume it's a matplotlib colormap
-    and we discretize in N discrete colors 
+    and we discretize in N discrete colors
     """
-
     if isinstance(colors, str):
-        cmap = cm.get_cmap(colors, N)
+        import matplotlib
+
+        cmap = matplotlib.colormaps[colors].resampled(N)
         cmap = cmap(np.arange(N))
         colors = cmap[::-1, :].tolist()
-    if isinstance(colors, list):
+    if isinstance(colors, (list, tuple)):
         if len(colors) == N:
-            colors = colors[::-1]
+            colors = list(colors)[::-1]
         else:
             raise Exception("\n\nnumber of colors {} not equal to number of categories{}\n".format(len(colors), N))
+    return colors
+
+
+@lru_cache(maxsize=GAUGE_CACHE_SIZE)
+def _render_gauge(labels, colors, arrow, title, fmt):
+    # begin with sanity checks
+    N = len(labels)
+
+    if arrow > N:
+        raise Exception("\n\nThe category ({}) is greated than the length\nof the labels ({})".format(arrow, N))
+
+    colors = _gauge_colors(colors, N)
 
     """
     begins the plotting
     """
 
-    fig, ax = plt.subplots(figsize=(2, 2))
+    with figure_pool.figure((2, 2), name='gauge') as fig:
+        return _draw_gauge(fig, labels, colors, arrow, title, fmt)
+
+
+def _draw_gauge(fig, labels, colors, arrow, title, fmt):
+    from matplotlib.patches import Circle, Wedge, Rectangle
+
+    N = len(labels)
+    ax = fig.subplots()
 
     ang_range, mid_points = degree_range(N)
 
@@ -217,23 +311,60 @@ def gauge(labels=['LOW', 'MEDIUM', 'HIGH', 'VERY HIGH', 'EXTREME'], colors='jet_
     ax.axes.set_xticks([])
     ax.axes.set_yticks([])
     ax.axis('equal')
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Save the figure to a BytesIO object
     buf = BytesIO()
-    plt.savefig(buf, format='png')
+    fig.savefig(buf, format=fmt)
     buf.seek(0)
 
     # Convert the figure to a data URI
     encoded_image = base64.b64encode(buf.getvalue()).decode('utf-8')
-    data_uri = 'data:image/png;base64,' + encoded_image
-
-    # Close the figure
-    plt.close()
+    mime = 'image/svg+xml' if fmt == 'svg' else 'image/png'
+    data_uri = f'data:{mime};base64,' + encoded_image
 
     return data_uri
 
 
+def gauge_figure(labels=('LOW', 'MEDIUM', 'HIGH', 'VERY HIGH', 'EXTREME'), colors='jet_r', arrow=1, title=''):
+    """
+    Plotly-native version of the gauge, rendered by the browser instead of matplotlib
+
+    :return: figure dict usable as a dcc.Graph figure
+    """
+    return copy.deepcopy(_gauge_figure(tuple(labels), colors if isinstance(colors, str) else tuple(colors),
+                                       arrow, title))
+
+
+@lru_cache(maxsize=GAUGE_CACHE_SIZE)
+def _gauge_figure(labels, colors, arrow, title):
+    N = len(labels)
+
+    if arrow > N:
+        raise Exception("\n\nThe category ({}) is greated than the length\nof the labels ({})".format(arrow, N))
+
+    # _gauge_colors orders colors right to left for the matplotlib wedges; plotly steps go left to right
+    colors = _gauge_colors(colors, N)[::-1]
+    if not all(isinstance(c, str) for c in colors):
+        # colormap colors come back from matplotlib as RGBA values
+        import matplotlib.colors
+
+        colors = [c if isinstance(c, str) else matplotlib.colors.to_hex(c) for c in colors]
+
+    fig = go.Figure(go.Indicator(
+        mode='gauge',
+        value=arrow - .5,
+        title={'text': title},
+        gauge={
+            'shape': 'angular',
+            'axis': {'range': [0, N], 'tickvals': [i + .5 for i in range(N)], 'ticktext': list(labels)},
+            'bar': {'color': 'black', 'thickness': .15},
+            'steps': [{'range': [i, i + 1], 'color': c} for i, c in enumerate(colors)],
+        }))
+    fig.update_layout(width=200, height=150, margin=dict(l=20, r=20, t=30, b=10))
+    return fig.to_dict()
+
+
 """
 This code was adapted from wind_rose.ipynb by Paul Hobson
 Available at: https://gist.github.com/phobson/41b41bdd157a2bcf6e14
@@ -262,52 +393,151 @@ def _convert_dir(directions, N=None):
     return barDir, barWidth
 
 
-def generate_wind_rose(forecast_df):
-    total_count = forecast_df.shape[0]
-    calm_count = forecast_df.query("windSpeed == 0").shape[0]
-
-    spd_bins = [-1, 0, 5, 10, 15, 20, 25, 30, np.inf]
-    spd_labels = speed_labels(spd_bins, units='knots')
-
-    dir_bins = np.arange(-7.5, 370, 15)
-    dir_labels = (dir_bins[:-1] + dir_bins[1:]) / 2
-
-    rose = (
-        forecast_df.assign(WindSpd_bins=lambda df:
-        pd.cut(df['windSpeed'], bins=spd_bins, labels=spd_labels, right=True)
-                           )
-        .assign(WindDir_bins=lambda df:
-        pd.cut(df["windDirection"], bins=dir_bins, labels=dir_labels, right=False)
-                )
-        .replace({'WindDir_bins': {360: 0}})
-        .groupby(by=['WindSpd_bins', 'WindDir_bins'], observed=False)
-        .size()
-        .unstack(level='WindSpd_bins')
-        .fillna(0)
-        .assign(calm=lambda df: calm_count / df.shape[0])
-        .sort_index(axis=1)
-        .apply(lambda col: col.map(lambda x: x / total_count * 100))
+def bin_wind(speed, direction, spd_bins=SPEED_BINS, n_sectors=DIRECTION_SECTORS):
+    """
+    Counts wind observations per direction sector and speed bin. Sectors are centred on multiples of
+    360 / n_sectors (north spans [-width/2, width/2)); speed bins are closed on the right like pd.cut.
+
+    :param speed: wind speeds, shape (n,), or (locations, n) for a stacked batch of locations
+    :param direction: wind directions in degrees, same shape as speed
+    :param spd_bins: speed bin edges
+    :param n_sectors: number of direction sectors
+    :return: counts of shape (n_sectors, n_bins), or (locations, n_sectors, n_bins) for a batch
+    """
+    batched = np.ndim(speed) == 2
+    speed = np.atleast_2d(np.asarray(speed, dtype=np.float64))
+    direction = np.atleast_2d(np.asarray(direction, dtype=np.float64))
+    n_locations, n_bins = speed.shape[0], len(spd_bins) - 1
+
+    speed_bin = np.digitize(speed, spd_bins, right=True) - 1
+    # NaN speeds land past the last edge; NaN directions and out-of-range speeds are not counted
+    valid = (speed_bin >= 0) & (speed_bin < n_bins) & ~np.isnan(direction)
+
+    width = 360. / n_sectors
+    sector = (np.mod(np.nan_to_num(direction) + width / 2, 360) // width).astype(np.intp) % n_sectors
 
-    )
+    location = np.broadcast_to(np.arange(n_locations)[:, None], speed.shape)
+    flat = ((location * n_sectors + sector) * n_bins + speed_bin)[valid]
+    counts = np.bincount(flat, minlength=n_locations * n_sectors * n_bins).reshape(n_locations, n_sectors, n_bins)
+
+    return counts if batched else counts[0]
+
+
+def rose_percentages(speed, direction, spd_bins=SPEED_BINS, n_sectors=DIRECTION_SECTORS):
+    """
+    Wind rose table as percentages of all observations, for one location or a stacked batch (see bin_wind).
+    Calm observations (speed == 0) are spread evenly over the sectors, matching the plotted rose.
+    """
+    counts = bin_wind(speed, direction, spd_bins, n_sectors).astype(np.float64)
+    total = np.shape(speed)[-1]
+    calm = (np.asarray(speed) == 0).sum(axis=-1)
+
+    counts[..., 0] = np.expand_dims(calm, -1) / n_sectors
+    return counts * (100 / total)
+
+
+def wind_rose_table(forecast_df, spd_bins=SPEED_BINS, n_sectors=DIRECTION_SECTORS, units='knots'):
+    """
+    Wind rose table of a forecast: one row per direction sector, one column per speed bin, in percent
+    """
+    import pandas as pd
+
+    rose = rose_percentages(forecast_df['windSpeed'].to_numpy(), forecast_df['windDirection'].to_numpy(),
+                            spd_bins, n_sectors)
+    return pd.DataFrame(rose,
+                        index=pd.Index(np.arange(n_sectors) * 360. / n_sectors, name='WindDir_bins'),
+                        columns=pd.Index(speed_labels(spd_bins, units), name='WindSpd_bins'))
+
+
+def generate_wind_rose(forecast_df, renderer=WIND_ROSE_RENDERER):
+    """
+    Bins the forecast winds and draws the wind rose
+
+    :param renderer: "plotly" or "png", see WIND_ROSE_RENDERER
+    :return: figure dict for a dcc.Graph, or a PNG data URI for an html.Img
+    """
+    rose = wind_rose_table(forecast_df)
+
+    if renderer == "plotly":
+        return wind_rose_figure(rose).to_dict()
 
-    directions = np.arange(0, 360, 15)
+    directions = rose.index.to_numpy()
 
-    # Generate the wind rose plot
-    wind_fig = wind_rose(rose, directions)
+    with figure_pool.figure((4, 4), name='wind-rose') as wind_fig:
+        # Generate the wind rose plot
+        wind_rose(rose, directions, fig=wind_fig)
 
-    # Save the figure to a BytesIO object and convert it to a data URI
-    wind_data_uri = save_figure_to_data_uri(wind_fig)
+        # Save the figure to a BytesIO object and convert it to a data URI
+        wind_data_uri = save_figure_to_data_uri(wind_fig)
 
     return wind_data_uri
 
 
-def wind_rose(rosedata, wind_dirs, palette=None):
+def _palette_points(n_colors):
+    """
+    Colormap positions of an n_colors palette, evenly spaced without the two extremes, as seaborn.color_palette picks
+    """
+    return np.linspace(0, 1, n_colors + 2)[1:-1]
+
+
+def wind_rose_figure(rosedata, palette=None):
+    """
+    Plotly version of wind_rose: one stacked barpolar trace per speed bin, drawn by the browser
+
+    :param rosedata: wind rose table from wind_rose_table, indexed by sector direction in degrees
+    :param palette: one color per speed bin; defaults to the matplotlib rose's inferno palette
+    """
+    if palette is None:
+        palette = plotly.colors.sample_colorscale(plotly.colors.sequential.Inferno, _palette_points(rosedata.shape[1]))
+
+    directions = rosedata.index.to_numpy()
+    width = 360. / len(directions)
+
+    fig = go.Figure([
+        go.Barpolar(r=rosedata[label].to_numpy(), theta=directions, width=width, name=label,
+                    marker=dict(color=color, line=dict(width=0)),
+                    hovertemplate='%{theta}°: %{r:.1f}%<extra>' + label + '</extra>')
+        for label, color in zip(rosedata.columns, palette)
+    ])
+
+    fig.update_layout(
+        width=400,
+        height=400,
+        margin=dict(l=30, r=30, t=30, b=30),
+        legend=dict(font=dict(size=8)),
+        polar=dict(
+            barmode='stack',
+            bargap=0,
+            radialaxis=dict(ticksuffix='%', tickfont=dict(size=8)),
+            angularaxis=dict(
+                rotation=90,
+                direction='clockwise',
+                tickmode='array',
+                tickvals=[0, 45, 90, 135, 180, 225, 270, 315],
+                ticktext=['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW']
+            )
+        )
+    )
+
+    return fig
+
+
+def wind_rose(rosedata, wind_dirs, palette=None, fig=None):
+    """
+    Draws the wind rose on fig, or on a new standalone figure when fig is None
+    """
     if palette is None:
-        palette = sns.color_palette('inferno', n_colors=rosedata.shape[1])
+        import matplotlib
+
+        palette = matplotlib.colormaps['inferno'](_palette_points(rosedata.shape[1]))
 
     bar_dir, bar_width = _convert_dir(wind_dirs)
 
-    fig, ax = plt.subplots(figsize=(4, 4), subplot_kw=dict(polar=True))
+    if fig is None:
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=(4, 4))
+    ax = fig.add_subplot(polar=True)
     ax.set_theta_direction('clockwise')
     ax.set_theta_zero_location('N')
 
@@ -0,0 +1,404 @@
+"""
+Micro-benchmarks for the dashboard's render path, runnable without API keys or network access.
+
+    python benchmark.py figure-size forecast-fig forecast-patch gauge wind-rose wind-rose-render recommendation-cache recommendation
+"""
+import base64
+import gc
+import json
+import os
+import sys
+import tempfile
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.utils import PlotlyJSONEncoder
+
+import aux_viz
+import clothes
+import figures
+import icons
+from openai_stub import openaiStub
+from aux_viz import (bin_wind, forecast_fig_patch, gauge, gauge_figure, generate_wind_rose, get_forecast_fig,
+                     speed_labels, wind_rose_table)
+from icons import DEFAULT_ICON, icon_index, icon_index_for, icon_source
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def sample_forecast(hours=24, seed=0):
+    """
+    Synthetic processed forecast with the columns the figure builders read
+    """
+    rng = np.random.default_rng(seed)
+    codes = sorted(icon_index)
+    time = pd.date_range("2023-08-05", periods=hours, freq="h", tz="UTC")
+    temperature = 70 + 10 * np.sin(np.arange(hours) / 24 * 2 * np.pi) + rng.normal(0, 1, hours)
+    df = pd.DataFrame({
+        "time": time,
+        "temperature": temperature.astype(np.float32),
+        "temperatureApparent": (temperature + rng.normal(0, 2, hours)).astype(np.float32),
+        "windSpeed": rng.gamma(2, 4, hours).astype(np.float32),
+        "windDirection": rng.uniform(0, 360, hours).astype(np.float32),
+        "weatherCode": rng.choice(codes, hours),
+    })
+    df["image_names"] = df["weatherCode"].map(icon_index)
+    df["local_time"] = df["time"].dt.strftime("%I:%M %p")
+    return df
+
+
+@benchmark("figure-size")
+def figure_size():
+    """
+    Serialized size of the 24 hour forecast figure for each icon variant
+    """
+    df = sample_forecast()
+    baseline = None
+    for variant in ("large", "64px", "64px.webp", "32px", "32px.webp"):
+        size = len(get_forecast_fig(df, icon_variant=variant).to_json())
+        baseline = baseline or size
+        print(f"{variant:>10}: {size / 1024:8.1f} KiB  ({size / baseline:.0%} of large)")
+
+
+def per_call(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def get_forecast_fig_incremental(df, icon_variant):
+    """
+    The original forecast figure builder, one validated add_layout_image per hour, kept as the reference for
+    get_forecast_fig
+    """
+    image_names = df['weatherCode'].map(icon_index_for(icon_variant)).fillna(DEFAULT_ICON)
+
+    fig = go.Figure(data=[
+        go.Scatter(x=df['temperature'].index, y=df['temperature'], mode='lines', line=dict(color='blue'),
+                   fillcolor="grey", name="Actual", legendrank=1),
+        go.Scatter(x=[df['temperature'].index[df['temperature'].idxmax()]],
+                   y=[df['temperature'].max()],
+                   text="H", textposition='top right',
+                   mode='markers', marker=dict(size=12, color='red'), name="Max", legendrank=3),
+        go.Scatter(x=[df['temperature'].index[df['temperature'].idxmin()]],
+                   y=[df['temperature'].min()],
+                   text="L", textposition='top right',
+                   mode='markers', marker=dict(size=12, color='blue'), name="Min", legendrank=4),
+        go.Scatter(x=df['temperature'].index, y=df['temperatureApparent'], mode='lines',
+                   line=dict(dash='dot', color="grey"), name="Feels Like", legendrank=2)
+    ])
+
+    for index, img_name in image_names.items():
+        fig.add_layout_image(dict(source=icon_source(img_name), xref="x", yref="paper", x=index - .5, y=1.1,
+                                  sizex=.8, sizey=.8, opacity=1, layer="above"))
+
+    fig.update_xaxes(ticktext=df['local_time'], tickvals=df['temperature'].index)
+    fig.update_layout(autosize=False, width=1000, height=600, title="24 Hour Weather Forecast",
+                      xaxis_title="Local Time", yaxis_title="Temperature (F°)")
+    return fig
+
+
+@benchmark("forecast-fig")
+def forecast_fig():
+    """
+    Build time and JSON size of the forecast figure per horizon, against the original incremental builder
+    """
+    df = sample_forecast()
+    expected = json.loads(get_forecast_fig_incremental(df, aux_viz.FIGURE_ICON_VARIANT).to_json())
+    for validate in (True, False):
+        assert json.loads(get_forecast_fig(df, validate=validate).to_json()) == expected
+    print("single-dict builder matches the incremental one")
+
+    print(f"{'':>27} {'build':>10} {'json':>10}")
+    for hours in (24, 48, 120):
+        df = sample_forecast(hours)
+        builders = {
+            "incremental": lambda: get_forecast_fig_incremental(df, aux_viz.FIGURE_ICON_VARIANT),
+            "single dict": lambda: get_forecast_fig(df),
+            "single dict, no valid.": lambda: get_forecast_fig(df, validate=False),
+        }
+        for name, build in builders.items():
+            if name == "incremental" and hours != 24:
+                continue
+            seconds = per_call(build, 10)
+            size = len(build().to_json())
+            print(f"{hours:>3}h {name:>22} {seconds * 1e3:7.2f} ms {size / 1024:6.1f} KiB")
+
+
+def decode_arrays(value):
+    """
+    Figure JSON with plotly's base64 typed arrays decoded to lists, so figures can be compared by value
+    """
+    if isinstance(value, dict):
+        if "bdata" in value:
+            return np.frombuffer(base64.b64decode(value["bdata"]), value["dtype"]).tolist()
+        return {key: decode_arrays(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_arrays(item) for item in value]
+    return value
+
+
+def apply_patch(figure, patch):
+    """
+    Applies the Assign operations of a dash.Patch to a figure dict, as the browser does
+    """
+    for operation in patch.to_plotly_json()["operations"]:
+        assert operation["operation"] == "Assign"
+        *path, key = operation["location"]
+        target = figure
+        for step in path:
+            target = target[step]
+        target[key] = operation["params"]["value"]
+    return figure
+
+
+@benchmark("forecast-patch")
+def forecast_patch():
+    """
+    Callback payload for a location change: the full forecast figure versus a dash.Patch of what changed
+    """
+    before, after = sample_forecast(seed=1), sample_forecast(seed=2)
+    patched = apply_patch(json.loads(get_forecast_fig(before).to_json()), forecast_fig_patch(after))
+    assert decode_arrays(patched) == decode_arrays(json.loads(get_forecast_fig(after).to_json()))
+    print("patched figure matches the rebuilt one")
+
+    payloads = {
+        "full figure": lambda: get_forecast_fig(after, validate=False).to_json(),
+        "patch": lambda: json.dumps(forecast_fig_patch(after).to_plotly_json(), cls=PlotlyJSONEncoder),
+    }
+    # inline data URIs dominate both payloads; served by url, the icons shrink to their paths
+    configured = icons.ICON_SOURCE
+    try:
+        for icon_source_setting in ("inline", "url"):
+            icons.ICON_SOURCE = icon_source_setting
+            for name, build in payloads.items():
+                print(f"{icon_source_setting:>6} icons, {name:>11}: {per_call(build, 20) * 1e3:6.2f} ms, "
+                      f"{len(build()) / 1024:6.1f} KiB")
+    finally:
+        icons.ICON_SOURCE = configured
+
+
+@benchmark("gauge")
+def gauge_latency():
+    """
+    Per-call latency of the UV gauge: uncached matplotlib renders versus memoized and Plotly-native output
+    """
+    labels, colors = ('0-2', '3-5', '6-7', '8-10', '11+'), ('#299501', '#f7e401', '#f95901', '#d90011', '#6c49cb')
+    render = aux_viz._render_gauge.__wrapped__
+    figure = aux_viz._gauge_figure.__wrapped__
+
+    timings = {
+        "png, uncached": per_call(lambda: render(labels, colors, 3, 'Moderate Risk', 'png'), 5),
+        "svg, uncached": per_call(lambda: render(labels, colors, 3, 'Moderate Risk', 'svg'), 5),
+        "plotly, uncached": per_call(lambda: figure(labels, colors, 3, 'Moderate Risk'), 5),
+        "png, memoized": per_call(lambda: gauge(labels, colors, arrow=3, title='Moderate Risk'), 1000),
+        "plotly, memoized": per_call(lambda: gauge_figure(labels, colors, arrow=3, title='Moderate Risk'), 1000),
+    }
+    for name, seconds in timings.items():
+        print(f"{name:>17}: {seconds * 1e6:10.1f} µs")
+
+
+def wind_rose_table_pandas(forecast_df):
+    """
+    The original pd.cut/groupby wind rose binning, kept as the reference for wind_rose_table
+    """
+    total_count = forecast_df.shape[0]
+    calm_count = forecast_df.query("windSpeed == 0").shape[0]
+
+    spd_bins = [-1, 0, 5, 10, 15, 20, 25, 30, np.inf]
+    spd_labels = speed_labels(spd_bins, units='knots')
+
+    dir_bins = np.arange(-7.5, 370, 15)
+    dir_labels = (dir_bins[:-1] + dir_bins[1:]) / 2
+
+    return (
+        forecast_df.assign(WindSpd_bins=lambda df:
+        pd.cut(df['windSpeed'], bins=spd_bins, labels=spd_labels, right=True)
+                           )
+        .assign(WindDir_bins=lambda df:
+        pd.cut(df["windDirection"], bins=dir_bins, labels=dir_labels, right=False)
+                )
+        .replace({'WindDir_bins': {360: 0}})
+        .groupby(by=['WindSpd_bins', 'WindDir_bins'], observed=False)
+        .size()
+        .unstack(level='WindSpd_bins')
+        .fillna(0)
+        .assign(calm=lambda df: calm_count / df.shape[0])
+        .sort_index(axis=1)
+        .apply(lambda col: col.map(lambda x: x / total_count * 100))
+    )
+
+
+@benchmark("wind-rose")
+def wind_rose_binning():
+    """
+    Checks the NumPy wind rose binning against the pandas reference, then times both and a stacked batch
+    """
+    for hours, seed in [(24, 0), (120, 1), (120, 2)]:
+        df = sample_forecast(hours, seed)
+        # exercise calm hours and the sector edges, including 360 wrapping onto north
+        df.loc[::7, 'windSpeed'] = 0
+        df.loc[1:6, 'windDirection'] = [352.5, 360, 7.5, 7.49, 0, 5]
+        df.loc[8:10, 'windSpeed'] = [5, 30, 30.01]
+        expected = wind_rose_table_pandas(df)
+        actual = wind_rose_table(df)
+        np.testing.assert_allclose(actual.to_numpy(), expected.to_numpy())
+        assert list(actual.columns) == list(expected.columns)
+        assert list(actual.index) == list(expected.index)
+    print("numpy binning matches the pandas implementation")
+
+    df = sample_forecast(120)
+    print(f"   pandas: {per_call(lambda: wind_rose_table_pandas(df), 20) * 1e6:10.1f} µs")
+    print(f"    numpy: {per_call(lambda: wind_rose_table(df), 200) * 1e6:10.1f} µs")
+
+    speeds = np.stack([sample_forecast(120, seed)['windSpeed'] for seed in range(100)])
+    directions = np.stack([sample_forecast(120, seed)['windDirection'] for seed in range(100)])
+    batch = per_call(lambda: bin_wind(speeds, directions), 20)
+    print(f"    numpy, batch of 100 locations: {batch * 1e6:10.1f} µs")
+
+
+@benchmark("wind-rose-render")
+def wind_rose_render():
+    """
+    Latency and payload of each wind rose renderer, and a memory regression check: repeated and concurrent PNG
+    renders must not register figures with pyplot or keep more figures alive than the pool holds
+    """
+    df = sample_forecast(120)
+    for renderer in ("plotly", "png"):
+        seconds = per_call(lambda: generate_wind_rose(df, renderer), 3)
+        size = len(str(generate_wind_rose(df, renderer)))
+        print(f"{renderer:>7}: {seconds * 1e3:8.1f} ms, {size / 1024:8.1f} KiB")
+
+    stats = []
+    figures.render_hooks.append(stats.append)
+    try:
+        expected = generate_wind_rose(df, "png")
+        for _ in range(20):
+            generate_wind_rose(df, "png")
+        # renders from concurrent callbacks each get their own figure and draw the same image
+        with ThreadPoolExecutor(4) as executor:
+            assert set(executor.map(lambda _: generate_wind_rose(df, "png"), range(8))) == {expected}
+    finally:
+        figures.render_hooks.remove(stats.append)
+    gc.collect()
+
+    assert not figures.pyplot_figures(), f"{figures.pyplot_figures()} figures registered with pyplot"
+    assert figures.live_figures() <= figures.figure_pool.maxsize, f"{figures.live_figures()} figures alive"
+    growth = (stats[-1]["rss"] - stats[0]["rss"]) / 1024 ** 2
+    print(f"{len(stats)} png renders: {figures.live_figures()} live figures, none in pyplot, "
+          f"rss {growth:+.1f} MiB")
+
+
+@benchmark("recommendation-cache")
+def recommendation_cache():
+    """
+    Hit rate of the bucketed recommendation cache over four weeks of synthetic hourly conditions, its memory and disk hit
+    latency, and a check that recommendations survive a restart and respect the TTL and size bounds
+    """
+    hours = 24 * 28
+    df = sample_forecast(hours)
+    rng = np.random.default_rng(1)
+    daylight = np.clip(np.sin((np.arange(hours) % 24 - 6) / 12 * np.pi), 0, None)
+    # rain is mostly 0 with wet spells, humidity drifts, and the UV index follows the sun
+    rain = np.where(rng.random(hours) < 0.7, 0, rng.integers(10, 100, hours))
+    humid = np.clip(60 + np.cumsum(rng.normal(0, 2, hours)), 20, 100).astype(int)
+    uv = np.round(daylight * rng.uniform(3, 9, hours)).astype(int)
+    conditions = [(float(temp), float(feels_like), int(r), int(h), int(u), float(wind), "Clear")
+                  for temp, feels_like, r, h, u, wind in zip(
+                      df["temperature"], df["temperatureApparent"], rain, humid, uv, df["windSpeed"])]
+    calls = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "recommendations.db")
+        cache = clothes.recommendationCache(path=path)
+        for condition in conditions:
+            cache.get_or_create(cache.key(*condition), lambda: calls.append(condition) or f"Wear {len(calls)}")
+        print(f"{len(conditions)} lookups: {len(calls)} recommender calls, hit rate {cache.hit_rate():.0%} "
+              f"({1 - len(set(conditions)) / len(conditions):.0%} with exact conditions as key)")
+        for name, buckets in (("coarse", {"temp": 10, "feels_like": 10, "rain": 20, "humid": 50, "wind": 10}),
+                              ("fine", {"temp": 1, "feels_like": 1, "rain": 5, "humid": 10, "wind": 1})):
+            bucketed = clothes.recommendationCache(path=os.path.join(directory, f"{name}.db"), buckets=buckets)
+            keys = {bucketed.key(*condition) for condition in conditions}
+            print(f"{name:>6} buckets: {len(keys)} distinct keys")
+
+        key = cache.key(*conditions[0])
+        memory = per_call(lambda: cache.get(cache.key(*conditions[0])), 10000)
+        # a new instance, as in a restarted or another worker, reads from disk once and then from memory
+        restarted = clothes.recommendationCache(path=path)
+        assert restarted.get(key) == cache.get(key)
+        disk = per_call(lambda: restarted._memory.clear() or restarted.get(key), 1000)
+        print(f"memory hit: {memory * 1e6:6.1f} µs, disk hit: {disk * 1e6:6.1f} µs")
+
+        expired = clothes.recommendationCache(path=path, ttl=0)
+        assert expired.get(key) is None
+        small = clothes.recommendationCache(path=path, maxsize=10)
+        small.set("new", "Wear a coat.")
+        assert len(small) == 10 and small.get("new") == "Wear a coat."
+
+
+@benchmark("recommendation")
+def recommendation_fallback():
+    """
+    Latency of the rule-based advice versus LLM calls against a local OpenAI stub, and the fallback behavior:
+    a slow API gives up after the timeout, and failures pause further calls instead of retrying each refresh
+    """
+    conditions = dict(temp=61.0, feels_like=58.0, rain=40, humid=70, uv=4, wind=12.0, description="Cloudy")
+    rules = per_call(lambda: clothes.rule_based_recommendation(**conditions), 10000)
+    print(f"   rule-based: {rules * 1e6:8.1f} µs")
+
+    stub = openaiStub(delay=0.05).start()
+    with tempfile.TemporaryDirectory() as directory:
+        def recommender(timeout=2.0):
+            cache = clothes.recommendationCache(path=os.path.join(directory, f"{stub.requests}.db"))
+            return clothes.clothesRecommender("stub-key", cache=cache, timeout=timeout, api_base=stub.api_base)
+
+        try:
+            fast = recommender()
+            # the openai package loads on the first call; keep its import out of the timing
+            import openai  # noqa: F401
+            start = timeit.default_timer()
+            assert fast.get_gpt4_response(**conditions) == stub.reply
+            llm = timeit.default_timer() - start
+            cached = per_call(lambda: fast.get_gpt4_response(**conditions), 1000)
+            assert stub.requests == 1
+            print(f"  LLM, stub:   {llm * 1e3:8.1f} ms  (cached {cached * 1e6:.1f} µs)")
+
+            for name, delay, status in (("slow", 1.0, 200), ("down", 0.0, 503)):
+                stub.delay, stub.status = delay, status
+                failing = recommender(timeout=0.3)
+                start = timeit.default_timer()
+                try:
+                    failing.get_gpt4_response(**conditions)
+                except Exception:
+                    pass
+                else:
+                    raise AssertionError(f"{name} API call succeeded")
+                failed = timeit.default_timer() - start
+                requests = stub.requests
+                start = timeit.default_timer()
+                assert failing.cached_response(**conditions) is None
+                try:
+                    failing.get_gpt4_response(**conditions)
+                except RuntimeError:
+                    pass
+                paused = timeit.default_timer() - start
+                assert stub.requests == requests and failing.stats["skipped"] == 1
+                print(f"  LLM, {name}: {failed * 1e3:8.1f} ms to fail, {paused * 1e6:.1f} µs while paused; "
+                      f"advice: {failing.local_response(**conditions)!r}")
+        finally:
+            stub.shutdown()
+            stub.server_close()
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f"== {name}")
+        BENCHMARKS[name]()
@@ -0,0 +1,222 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class ttlCache:
+    """
+    Size-bounded LRU cache whose entries expire after a per-entry TTL. Concurrent misses for the same key are
+    coalesced so only one caller runs the fetch while the others wait for its result. Entries may keep a stale
+    window after expiry, during which get_or_fetch serves them while a background fetch revalidates them.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (expires_at, stale_until, stored_at, value)
+        self._inflight = {}  # key -> Future of the fetch currently running for it
+        self._tasks = set()  # background revalidations of get_or_fetch_async
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "expired": 0, "evictions": 0, "stale": 0,
+                      "revalidations": 0}
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is missing or expired
+        """
+        with self._lock:
+            return self._lookup(key)
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        """
+        Stores value under key for ttl seconds, evicting the least recently used entries beyond maxsize
+
+        :param stale_ttl: seconds after expiry during which get_or_fetch may still serve the value
+        """
+        with self._lock:
+            self._store(key, value, ttl, stale_ttl)
+
+    def get_or_fetch(self, key, fetch, ttl, should_cache=None, stale_ttl=0, revalidate=None):
+        """
+        Returns the cached value for key, calling fetch() on a miss
+
+        :param key: hashable cache key
+        :param fetch: zero-argument callable producing the value
+        :param ttl: seconds the fetched value stays fresh
+        :param should_cache: optional predicate; values it rejects are returned but not stored
+        :param stale_ttl: seconds after expiry during which the value is served stale while it is refetched
+        :param revalidate: runs a zero-argument callable in the background, e.g. an executor's submit; stale values
+            are only served when it is given
+        :return: cached or freshly fetched value
+        """
+        with self._lock:
+            value, stale, pending, leader = self._begin(key, allow_stale=revalidate is not None)
+        if value is not None:
+            return value
+
+        if stale is not None:
+            # A fetch already running for key, e.g. a background refresh, revalidates it as well
+            if leader:
+                revalidate(lambda: self._fetch(key, pending, fetch, ttl, should_cache, stale_ttl))
+            return stale
+
+        if not leader:
+            return pending.result()
+        return self._fetch(key, pending, fetch, ttl, should_cache, stale_ttl)
+
+    async def get_or_fetch_async(self, key, fetch, ttl, should_cache=None, stale_ttl=0, revalidate=False):
+        """
+        Coroutine version of get_or_fetch. Misses coalesce with concurrent sync and async callers of the same key,
+        whichever of them runs the fetch.
+
+        :param fetch: zero-argument coroutine function producing the value
+        :param revalidate: serve values within their stale window and refetch them on a task of the running loop
+        """
+        # Only coroutine callers need asyncio, and it would add to the import time of every module using the cache
+        import asyncio
+
+        with self._lock:
+            value, stale, pending, leader = self._begin(key, allow_stale=revalidate)
+        if value is not None:
+            return value
+
+        if stale is not None:
+            if leader:
+                task = asyncio.get_running_loop().create_task(
+                    self._fetch_async(key, pending, fetch, ttl, should_cache, stale_ttl))
+                # Keeps the task referenced until it finishes; its failure stays with the Future of the fetch
+                self._tasks.add(task)
+                task.add_done_callback(lambda done: self._tasks.discard(done) or done.cancelled() or done.exception())
+            return stale
+
+        if not leader:
+            return await asyncio.wrap_future(pending)
+        return await self._fetch_async(key, pending, fetch, ttl, should_cache, stale_ttl)
+
+    def refresh(self, key, fetch, ttl, should_cache=None, stale_ttl=0):
+        """
+        Fetches key again and replaces its entry, whether or not the cached value is still fresh. Joins the fetch
+        already running for key, if any.
+
+        :return: fetched value
+        """
+        with self._lock:
+            pending, leader = self._claim(key, count=False)
+
+        if not leader:
+            return pending.result()
+        return self._fetch(key, pending, fetch, ttl, should_cache, stale_ttl)
+
+    def age(self, key):
+        """
+        Seconds since the entry for key was stored, stale or not, or None if there is none. Does not count as a use.
+        """
+        entry = self._entries.get(key)
+        return None if entry is None else time.monotonic() - entry[2]
+
+    def expires_at(self, key):
+        """
+        time.monotonic() at which the entry for key stops being fresh, or None if there is none
+        """
+        entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _begin(self, key, allow_stale):
+        """
+        Looks key up for get_or_fetch; lock held
+
+        :return: (fresh value or None, stale value or None, Future of the fetch, True if the caller must run it);
+            the Future is None on a fresh hit
+        """
+        value = self._lookup(key)
+        if value is not None:
+            return value, None, None, False
+
+        stale = self._lookup_stale(key) if allow_stale else None
+        pending, leader = self._claim(key, count=stale is None)
+        if stale is not None:
+            self.stats["stale"] += 1
+            self.stats["revalidations"] += leader
+        return None, stale, pending, leader
+
+    def _claim(self, key, count=True):
+        """
+        Returns (Future of the fetch for key, True if the caller is the one that must run it); lock held
+        """
+        pending = self._inflight.get(key)
+        if pending is not None:
+            if count:
+                self.stats["coalesced"] += 1
+            return pending, False
+
+        if count:
+            self.stats["misses"] += 1
+        pending = self._inflight[key] = Future()
+        return pending, True
+
+    def _fetch(self, key, pending, fetch, ttl, should_cache, stale_ttl):
+        try:
+            value = fetch()
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        else:
+            pending.set_result(value)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if not pending.exception() and (should_cache is None or should_cache(value)):
+                    self._store(key, value, ttl, stale_ttl)
+        return value
+
+    async def _fetch_async(self, key, pending, fetch, ttl, should_cache, stale_ttl):
+        try:
+            value = await fetch()
+        except BaseException as e:
+            pending.set_exception(e)
+            raise
+        else:
+            pending.set_result(value)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if not pending.exception() and (should_cache is None or should_cache(value)):
+                    self._store(key, value, ttl, stale_ttl)
+        return value
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if entry[0] <= now:
+            # Expired entries stay until their stale window closes, for _lookup_stale
+            if entry[1] <= now:
+                del self._entries[key]
+                self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[3]
+
+    def _lookup_stale(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        self._entries.move_to_end(key)
+        return entry[3]
+
+    def _store(self, key, value, ttl, stale_ttl=0):
+        now = time.monotonic()
+        self._entries[key] = (now + ttl, now + ttl + stale_ttl, now, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
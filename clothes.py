@@ -1,14 +1,254 @@
-import openai
+import math
+import os
+import time
+
+from cache import ttlCache
+from store import get_db
+
+# On-disk recommendation store shared by every worker process, keyed by bucketed weather conditions
+REC_CACHE_DB = os.environ.get("WEATHER_REC_CACHE_DB", "recommendations.db")
+
+# Seconds a recommendation is reused, and how many are kept; the least recently used are evicted beyond that
+REC_CACHE_TTL = float(os.environ.get("WEATHER_REC_CACHE_TTL", 7 * 24 * 3600))
+REC_CACHE_SIZE = int(os.environ.get("WEATHER_REC_CACHE_SIZE", 5000))
+
+# Bucket width of each numeric input; conditions in the same buckets share a recommendation.
+# Override with e.g. WEATHER_REC_BUCKETS="temp=10,rain=20"
+REC_BUCKETS = {"temp": 5, "feels_like": 5, "rain": 10, "humid": 20, "wind": 5}
+REC_BUCKETS.update({name: float(step) for name, step in
+                    (item.split("=") for item in os.environ.get("WEATHER_REC_BUCKETS", "").split(",") if item)})
+
+# Upper bounds of the WHO UV index bands: low, moderate, high, very high, and extreme above the last one
+UV_BANDS = (2, 5, 7, 10)
+
+# Recommendations kept in memory per process, in front of the on-disk store
+MEMORY_SIZE = 1024
+
+# Seconds an OpenAI call may take before the dashboard keeps the rule-based advice, and seconds calls are skipped
+# after one fails or times out
+REC_TIMEOUT = float(os.environ.get("WEATHER_REC_TIMEOUT", 10))
+REC_RETRY_AFTER = 60
+
+# Base clothing by feels-like temperature: (upper bound in °F, what to wear below it)
+LAYERS = (
+    (20, "a heavy winter coat, a hat, a scarf and insulated gloves"),
+    (35, "a warm winter coat with a hat and gloves"),
+    (50, "a warm jacket over a sweater"),
+    (60, "a light jacket or a long-sleeved layer"),
+    (70, "a long-sleeved shirt or a t-shirt with a light layer to hand"),
+    (80, "a t-shirt with light pants or shorts"),
+    (90, "light, breathable clothing such as shorts and a t-shirt"),
+    (math.inf, "the lightest, loosest clothing you have, in light colors"),
+)
+
+REC_SCHEMA = """CREATE TABLE IF NOT EXISTS recommendations (
+                   key TEXT PRIMARY KEY,
+                   recommendation TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_used REAL NOT NULL)"""
+
+
+def get_rec_db(path=REC_CACHE_DB):
+    """
+    Returns this thread's connection to the recommendation store, creating the table on first use
+    """
+    return get_db(path, REC_SCHEMA)
+
+
+def uv_band(uv):
+    """
+    Index of the WHO band of a UV index, from 0 (low) to 4 (extreme)
+    """
+    return sum(uv > bound for bound in UV_BANDS)
+
+
+def bucket_key(temp, feels_like, rain, humid, uv, wind, description, buckets=None):
+    """
+    Quantizes weather conditions into a cache key: every numeric input is floored to its bucket width and the
+    UV index is reduced to its band, so similar conditions map to the same key
+
+    :param buckets: bucket width per input, defaults to REC_BUCKETS
+    :return: str key
+    """
+    buckets = buckets or REC_BUCKETS
+
+    def bucket(name, value):
+        if value is None or math.isnan(value):
+            return "-"
+        step = buckets[name]
+        return f"{math.floor(value / step) * step:g}"
+
+    return "|".join((bucket("temp", temp), bucket("feels_like", feels_like), bucket("rain", rain),
+                     bucket("humid", humid), "-" if uv is None else str(uv_band(uv)), bucket("wind", wind),
+                     str(description)))
+
+
+def rule_based_recommendation(temp, feels_like, rain, humid, uv, wind, description):
+    """
+    Deterministic clothing advice from the same inputs as clothesRecommender.get_gpt4_response, computed locally in
+    microseconds. Used until, or instead of, the LLM's answer.
+
+    :return: str of 1-3 sentences starting with "Wear"
+    """
+    # Dress for mild weather when neither temperature was reported
+    apparent = next((value for value in (feels_like, temp) if value is not None and not math.isnan(value)), 65)
+    base = next(clothing for bound, clothing in LAYERS if apparent < bound)
+    if (humid or 0) >= 80 and apparent >= 75:
+        base += ", ideally in moisture-wicking fabric"
+    description = str(description).lower()
+
+    extras = []
+    if (rain or 0) >= 50 or any(word in description for word in ("rain", "drizzle", "thunderstorm")):
+        extras.append("a waterproof jacket or an umbrella")
+    elif (rain or 0) >= 30:
+        extras.append("an umbrella just in case")
+    if any(word in description for word in ("snow", "ice", "freezing", "flurries")):
+        extras.append("waterproof boots")
+    if (wind or 0) >= 20 and apparent < 70:
+        extras.append("a windproof outer layer")
+
+    recommendation = f"Wear {base}."
+    if extras:
+        recommendation += f" Add {', '.join(extras[:-1]) + ' and ' if len(extras) > 1 else ''}{extras[-1]}."
+    if uv is not None and uv_band(uv) >= 2:
+        recommendation += " Protect yourself from the sun with sunglasses, a hat and sunscreen."
+    elif uv is not None and uv_band(uv) == 1:
+        recommendation += " Sunscreen is a good idea."
+    return recommendation
+
+
+class recommendationCache:
+    """
+    Persistent TTL/LRU cache of clothing recommendations keyed by bucketed weather conditions. Hits are served from
+    an in-memory ttlCache in microseconds; misses fall through to the SQLite store shared by all workers, and only
+    then to the recommender. Concurrent misses for the same key make a single recommender call.
+    """
+
+    def __init__(self, path=REC_CACHE_DB, ttl=REC_CACHE_TTL, maxsize=REC_CACHE_SIZE, buckets=None):
+        """
+        :param path: SQLite file of the store
+        :param ttl: seconds a recommendation is reused
+        :param maxsize: recommendations kept in the store
+        :param buckets: bucket width per input, defaults to REC_BUCKETS
+        """
+        self.path = path
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.buckets = dict(REC_BUCKETS, **(buckets or {}))
+        self._memory = ttlCache(maxsize=min(maxsize, MEMORY_SIZE))
+        self._used = {}  # key -> last memory hit not yet written to the store
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+
+    def key(self, temp, feels_like, rain, humid, uv, wind, description):
+        return bucket_key(temp, feels_like, rain, humid, uv, wind, description, self.buckets)
+
+    def get(self, key):
+        """
+        Returns the recommendation stored under key, or None if there is none or it expired
+        """
+        recommendation = self._memory.get(key)
+        if recommendation is not None:
+            self.stats["hits"] += 1
+            self._used[key] = time.time()
+            return recommendation
+
+        row = get_rec_db(self.path).execute(
+            "SELECT recommendation, created_at FROM recommendations WHERE key = ? AND created_at > ?",
+            (key, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+
+        recommendation, created_at = row
+        self.stats["disk_hits"] += 1
+        self._used[key] = time.time()
+        self._memory.set(key, recommendation, ttl=created_at + self.ttl - time.time())
+        return recommendation
+
+    def get_or_create(self, key, create):
+        """
+        Returns the recommendation stored under key, calling create() and storing its result on a miss.
+        Failed calls raise and store nothing.
+        """
+        recommendation = self.get(key)
+        if recommendation is not None:
+            return recommendation
+
+        created = []
+
+        def create_and_store():
+            created.append(key)
+            return self.set(key, create())
+
+        try:
+            return self._memory.get_or_fetch(key, create_and_store, ttl=self.ttl)
+        finally:
+            # Only the caller that ran create() missed; the others joined its call
+            self.stats["misses" if created else "coalesced"] += 1
+
+    def set(self, key, recommendation):
+        """
+        Stores a recommendation, then evicts expired and least recently used ones
+
+        :return: recommendation
+        """
+        now = time.time()
+        used, self._used = self._used, {}
+        conn = get_rec_db(self.path)
+        with conn:
+            conn.executemany("UPDATE recommendations SET last_used = ? WHERE key = ?",
+                             [(last_used, used_key) for used_key, last_used in list(used.items())])
+            conn.execute("INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?)", (key, recommendation, now, now))
+            conn.execute("DELETE FROM recommendations WHERE created_at <= ?", (now - self.ttl,))
+            conn.execute("""DELETE FROM recommendations WHERE key NOT IN (
+                                SELECT key FROM recommendations ORDER BY last_used DESC LIMIT ?)""", (self.maxsize,))
+        self._memory.set(key, recommendation, ttl=self.ttl)
+        return recommendation
+
+    def hit_rate(self):
+        """
+        Share of lookups answered without a recommender call of their own (from memory, the store, or by joining
+        a call already running for the same key), or None before the first lookup
+        """
+        hits = self.stats["hits"] + self.stats["disk_hits"] + self.stats["coalesced"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else None
+
+    def __len__(self):
+        return get_rec_db(self.path).execute("SELECT COUNT(*) FROM recommendations").fetchone()[0]
 
 
 class clothesRecommender:
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None, timeout=REC_TIMEOUT, api_base=None):
+        """
+        :param api_key: OpenAI API key
+        :param cache: recommendationCache to reuse advice for similar conditions; a default one is created when None
+        :param timeout: seconds an OpenAI request may take
+        :param api_base: OpenAI-compatible endpoint, e.g. a local stub; defaults to the openai package's
+        """
         self.api_key = api_key
+        self.cache = cache if cache is not None else recommendationCache()
+        self.timeout = timeout
+        self.api_base = api_base
+        self._retry_at = 0
+        self.stats = {"calls": 0, "failures": 0, "skipped": 0}
+
+    def local_response(self, temp, feels_like, rain, humid, uv, wind, description):
+        """
+        Rule-based advice for the conditions, see rule_based_recommendation
+        """
+        return rule_based_recommendation(temp, feels_like, rain, humid, uv, wind, description)
+
+    def cached_response(self, temp, feels_like, rain, humid, uv, wind, description):
+        """
+        Returns the cached LLM advice for conditions in the same buckets, or None without calling the API
+        """
+        return self.cache.get(self.cache.key(temp, feels_like, rain, humid, uv, wind, description))
 
     def get_gpt4_response(self, temp, feels_like, rain, humid, uv, wind, description):
         """
         Get a response from the GPT-4 API based on the given weather conditions using the chat completions API.
+        Conditions that fall in the same buckets as an earlier call get that call's cached response.
 
         Parameters:
         - temp (float): Current temperature in Fahrenheit .
@@ -23,6 +263,22 @@ class clothesRecommender:
         Returns:
         - str: GPT-4's response.
         """
+        key = self.cache.key(temp, feels_like, rain, humid, uv, wind, description)
+        return self.cache.get_or_create(
+            key, lambda: self.ask_openai(temp, feels_like, rain, humid, uv, wind, description))
+
+    def ask_openai(self, temp, feels_like, rain, humid, uv, wind, description):
+        """
+        Asks the chat completions API for a recommendation, bypassing the cache. Takes the same parameters as
+        get_gpt4_response. After a failure or timeout, calls fail immediately for REC_RETRY_AFTER seconds, so a
+        slow or unavailable API does not tie up threads.
+        """
+        if time.monotonic() < self._retry_at:
+            self.stats["skipped"] += 1
+            raise RuntimeError(f"OpenAI calls paused for {self._retry_at - time.monotonic():.0f} s after a failure")
+
+        # Imported on first use; the openai package adds a noticeable share of the app's startup time
+        import openai
 
         # Initialize the OpenAI API
         openai.api_key = self.api_key
@@ -43,10 +299,18 @@ class clothesRecommender:
         messages = [{"role": "user", "content": message_content}]
 
         # Call the OpenAI API
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=messages
-        )
+        self.stats["calls"] += 1
+        try:
+            response = openai.ChatCompletion.create(
+                model="gpt-3.5-turbo",
+                messages=messages,
+                request_timeout=self.timeout,
+                **({"api_base": self.api_base} if self.api_base else {})
+            )
+        except Exception:
+            self.stats["failures"] += 1
+            self._retry_at = time.monotonic() + REC_RETRY_AFTER
+            raise
 
         # Extract the assistant's response from the API response
         recommendation = response['choices'][0]['message']['content']
@@ -0,0 +1,152 @@
+"""
+Pool of reusable matplotlib figures for server-side rendering. Figures are built with the object-oriented
+Figure/FigureCanvasAgg API, so renders never register with pyplot's global figure manager and can run from several
+callback threads at once, each on its own figure.
+
+matplotlib is only imported when the first figure is created.
+
+Every pooled render reports its duration, the number of live figures and the process RSS to the functions in
+render_hooks, so a worker that starts leaking figures shows up in the logs (set WEATHER_RENDER_STATS=1).
+"""
+import os
+import sys
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+# Idle figures kept per pool; more concurrent renders than this create figures that are dropped afterwards
+POOL_SIZE = int(os.environ.get("WEATHER_FIGURE_POOL_SIZE", 4))
+
+# Functions called with a dict of render stats after every pooled render
+render_hooks = []
+
+# Every figure a pool has created and that is still alive, whether idle or checked out
+_figures = weakref.WeakSet()
+
+
+def live_figures():
+    """
+    Number of pool-created figures still in memory, idle ones included
+    """
+    return len(_figures)
+
+
+def pyplot_figures():
+    """
+    Number of figures registered with pyplot; anything above zero in a worker is a figure someone forgot to close
+    """
+    # pyplot registers figures in _pylab_helpers; if it was never imported, nothing can be registered
+    helpers = sys.modules.get("matplotlib._pylab_helpers")
+    return helpers.Gcf.get_num_fig_managers() if helpers is not None else 0
+
+
+def current_rss():
+    """
+    Resident set size of the process in bytes. Falls back to the peak RSS where /proc is unavailable,
+    and returns None on platforms that offer neither.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def report_render(name, seconds, pool=None):
+    """
+    Passes the stats of one render to every function in render_hooks
+    """
+    if not render_hooks:
+        return
+
+    stats = {
+        "name": name,
+        "seconds": seconds,
+        "live_figures": live_figures(),
+        "idle_figures": len(pool) if pool is not None else 0,
+        "pyplot_figures": pyplot_figures(),
+        "rss": current_rss(),
+    }
+    for hook in render_hooks:
+        hook(stats)
+
+
+def print_render_stats(stats):
+    rss = f"{stats['rss'] / 1024 ** 2:.1f} MiB" if stats["rss"] is not None else "n/a"
+    print(f"render {stats['name']}: {stats['seconds'] * 1e3:.1f} ms, {stats['live_figures']} live figures "
+          f"({stats['idle_figures']} idle, {stats['pyplot_figures']} pyplot), rss {rss}")
+
+
+class figurePool:
+    """
+    Thread-safe pool of Agg figures. A figure is checked out for one render, then cleared and put back,
+    so its canvas and renderer are reused by the next render of the same size.
+    """
+
+    def __init__(self, maxsize=POOL_SIZE):
+        """
+        :param maxsize: maximum number of idle figures kept for reuse
+        """
+        self.maxsize = maxsize
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._idle)
+
+    def acquire(self, figsize):
+        with self._lock:
+            fig = self._idle.pop() if self._idle else None
+
+        if fig is None:
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+            _figures.add(fig)
+        else:
+            fig.set_size_inches(figsize)
+        return fig
+
+    def release(self, fig):
+        from matplotlib.figure import SubplotParams
+
+        fig.clear()
+        # clear() keeps the margins set by tight_layout or subplots_adjust
+        fig.subplotpars = SubplotParams()
+
+        with self._lock:
+            if len(self._idle) < self.maxsize:
+                self._idle.append(fig)
+
+    @contextmanager
+    def figure(self, figsize, name="figure"):
+        """
+        Checks out a cleared figure of the given size for the duration of the block and reports the render
+
+        :param figsize: (width, height) in inches
+        :param name: render name passed to render_hooks
+        """
+        start = time.perf_counter()
+        fig = self.acquire(figsize)
+        try:
+            yield fig
+        finally:
+            self.release(fig)
+            report_render(name, time.perf_counter() - start, self)
+
+
+figure_pool = figurePool()
+
+if os.environ.get("WEATHER_RENDER_STATS"):
+    render_hooks.append(print_render_stats)
@@ -0,0 +1,117 @@
+"""
+Compact, memory-mapped icon bundle replacing the pickled icon dictionary.
+
+Layout (all integers little-endian):
+    magic b"WIB1" | u32 entry count | index entries | concatenated image payloads (PNG or WebP)
+    index entry: u16 name length | name (utf-8) | u64 payload offset from file start | u32 payload length
+Several entries may point at the same payload when their images are identical.
+
+Opening a bundle only parses the index; payloads are served as zero-copy memoryviews into a read-only mmap,
+so every worker process shares the same pages through the OS page cache. Unlike pickle, loading a bundle
+never executes code from the file.
+"""
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+from collections.abc import Mapping
+
+MAGIC = b"WIB1"
+_HEADER = struct.Struct("<4sI")
+_NAME_LEN = struct.Struct("<H")
+_LOCATION = struct.Struct("<QI")
+
+
+def write_bundle(path, files):
+    """
+    Writes a {name: bytes} mapping as a bundle. Identical images (e.g. the wintry mix icon shared by a dozen
+    codes) are stored once and referenced by several index entries. The file is written next to path and
+    renamed into place, so readers never see a partial bundle.
+
+    :param path: bundle path
+    :param files: mapping of icon file name -> image bytes
+    """
+    names = [name.encode("utf-8") for name in files]
+    index_size = sum(_NAME_LEN.size + len(name) + _LOCATION.size for name in names)
+
+    offset = _HEADER.size + index_size
+    index = [_HEADER.pack(MAGIC, len(names))]
+    payloads = []
+    offsets = {}  # content hash -> offset of the payload already written for it
+    for name, content in zip(names, files.values()):
+        digest = hashlib.sha256(content).digest()
+        if digest not in offsets:
+            offsets[digest] = offset
+            payloads.append(content)
+            offset += len(content)
+        index.append(_NAME_LEN.pack(len(name)) + name + _LOCATION.pack(offsets[digest], len(content)))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.writelines(index)
+        f.writelines(payloads)
+    os.replace(tmp_path, path)
+
+
+def convert_pickle(pickle_path, bundle_path):
+    """
+    Converts a data.pkl written by older versions of scrape_icons.py into a bundle. Only run this on pickles
+    you produced yourself.
+
+    :return: number of icons written
+    """
+    with open(pickle_path, "rb") as f:
+        files = pickle.load(f)
+    write_bundle(bundle_path, files)
+    return len(files)
+
+
+class iconBundle(Mapping):
+    """
+    Read-only {name: memoryview} mapping over a memory-mapped bundle file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        magic, count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an icon bundle")
+
+        self._index = {}
+        pos = _HEADER.size
+        for _ in range(count):
+            (name_len,) = _NAME_LEN.unpack_from(self._mmap, pos)
+            pos += _NAME_LEN.size
+            name = self._mmap[pos:pos + name_len].decode("utf-8")
+            pos += name_len
+            self._index[name] = _LOCATION.unpack_from(self._mmap, pos)
+            pos += _LOCATION.size
+
+    def __getitem__(self, name):
+        offset, length = self._index[name]
+        return self._view[offset:offset + length]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def close(self):
+        self._view.release()
+        self._mmap.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    source, target = sys.argv[1:3] if len(sys.argv) > 2 else ("data.pkl", "icons.bundle")
+    print(f"Wrote {convert_pickle(source, target)} icons to {target}")
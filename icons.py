@@ -0,0 +1,135 @@
+"""
+Shared weather icon store: the pack scraped with scrape_icons.py, memory-mapped once per process, a code -> icon name
+index, memoized data URIs, and an optional static route for serving icons by url.
+Icon file names look like 10001_clear_large@2x.png: a 5 digit weather code (base code + day/night digit),
+a description, and a size variant with an optional @2x retina suffix, or a pixel size for the pre-resized
+variants (10001_clear_32px.webp).
+"""
+import base64
+import os
+import pickle
+import re
+from functools import lru_cache
+
+from icon_bundle import iconBundle
+from weathercode import weatherCode
+
+ICON_PACK = 'icons.bundle'
+LEGACY_ICON_PACK = 'data.pkl'
+# Default variant, and the order the others are tried in when a code lacks it. Pre-resized variants built by
+# scrape_icons.py are named by size ("32px"), with a ".webp" suffix for the WebP copies ("32px.webp").
+ICON_VARIANTS = ("large", "large@2x", "small", "small@2x")
+DEFAULT_ICON = "10000_clear_large.png"
+
+# How figures reference icons: "inline" embeds base64 data URIs, "url" points at ICON_ROUTE so browsers cache them
+ICON_SOURCE = os.environ.get("WEATHER_ICON_SOURCE", "inline")
+ICON_ROUTE = "/icons/"
+# Icon file names never change content, so browsers may keep them for a year
+ICON_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_ICON_NAME = re.compile(r"^(\d+)_.*_((?:small|large)(?:@2x)?|\d+px)\.(png|webp)$")
+
+
+def load_icon_pack(path=ICON_PACK):
+    """
+    Opens the icon bundle written by scrape_icons.py as a {file name: PNG memoryview} mapping. A legacy data.pkl
+    is still read when no bundle exists (convert it with python icon_bundle.py).
+    """
+    if not os.path.exists(path) and os.path.exists(LEGACY_ICON_PACK):
+        print(f"{path} not found, loading {LEGACY_ICON_PACK}")
+        with open(LEGACY_ICON_PACK, 'rb') as f:
+            return pickle.load(f)
+    return iconBundle(path)
+
+
+def build_icon_index(names, variants=ICON_VARIANTS):
+    """
+    Maps every weather code to the name of its icon in the preferred variant. Codes without their own icon fall
+    back to the day icon of the same base code (e.g. a night code whose pack only ships a day picture).
+
+    :param names: icon file names
+    :param variants: size variants in order of preference
+    :return: dict of int weather code -> icon file name
+    """
+    by_code = {}
+    for name in names:
+        match = _ICON_NAME.match(name)
+        if match:
+            by_code.setdefault(int(match.group(1)), {})[icon_variant(match)] = name
+
+    index = {}
+    for code, available in by_code.items():
+        index[code] = next((available[v] for v in variants if v in available), next(iter(available.values())))
+
+    for code in map(int, weatherCode):
+        if code not in index and code // 10 * 10 in index:
+            index[code] = index[code // 10 * 10]
+    return index
+
+
+def icon_variant(match):
+    """
+    Variant label of a parsed icon file name, e.g. "large@2x", "32px" or "32px.webp"
+    """
+    size, fmt = match.group(2), match.group(3)
+    return size if fmt == "png" else f"{size}.{fmt}"
+
+
+@lru_cache(maxsize=None)
+def icon_index_for(variant):
+    """
+    Code -> icon name index preferring the given variant, built on first use
+
+    :param variant: variant label such as "32px"; codes lacking it fall back to ICON_VARIANTS
+    """
+    return build_icon_index(png_files, (variant,) + ICON_VARIANTS)
+
+
+def missing_icon_codes(codes):
+    """
+    Returns the weather codes, out of codes, that have no icon of their own in the pack
+    """
+    return sorted(code for code in codes if code not in icon_codes)
+
+
+@lru_cache(maxsize=None)
+def icon_data_uri(name):
+    """
+    Base64 data URI of an icon, encoded on first use and memoized
+    """
+    mime = "image/webp" if name.endswith(".webp") else "image/png"
+    return f"data:{mime};base64," + base64.b64encode(png_files[name]).decode('utf-8')
+
+
+def icon_source(name):
+    """
+    Image source for an icon in a figure, following ICON_SOURCE
+    """
+    if ICON_SOURCE == "url":
+        return ICON_ROUTE + name
+    return icon_data_uri(name)
+
+
+def register_icon_route(server):
+    """
+    Serves the icon pack from ICON_ROUTE on the app's Flask server with long-lived cache headers
+
+    :param server: Flask server, e.g. app.server of a Dash app
+    """
+    import flask
+
+    @server.route(ICON_ROUTE + "<name>")
+    def serve_icon(name):
+        content = png_files.get(name)
+        if content is None:
+            flask.abort(404)
+        mimetype = "image/webp" if name.endswith(".webp") else "image/png"
+        response = flask.Response(bytes(content), mimetype=mimetype)
+        response.headers["Cache-Control"] = ICON_CACHE_CONTROL
+        return response
+
+
+png_files = load_icon_pack()
+icon_index = build_icon_index(png_files)
+# Codes that ship their own picture, as opposed to borrowing the day icon
+icon_codes = {int(match.group(1)) for match in map(_ICON_NAME.match, png_files) if match}
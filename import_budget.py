@@ -0,0 +1,105 @@
+"""
+Import-time budget for the dashboard's modules, to catch cold-start regressions.
+
+    python import_budget.py             # exits with 1 when a module is over budget
+    python import_budget.py --top 10    # also lists each module's slowest imports
+
+Every module is imported in a fresh interpreter under python -X importtime, and its cumulative import time is the
+best of RUNS runs. A module also fails when it imports one of its DEFERRED dependencies, which must load on first use.
+main is imported with WEATHER_WARMUP=off, so the figure includes building the app but no network calls.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Cumulative import time allowed per module, in milliseconds
+BUDGETS_MS = {
+    "figures": 30,
+    "clothes": 30,
+    "aux_viz": 400,
+    "location": 1000,
+    "api_utils": 1100,
+    "refresher": 1100,
+    "main": 3000,
+}
+
+# Dependencies that a module must not import, because only some code paths need them
+DEFERRED = {
+    "figures": ["matplotlib"],
+    "clothes": ["openai"],
+    "aux_viz": ["matplotlib", "seaborn", "pandas", "dash"],
+    "location": ["geopy", "pgeocode", "timezonefinder"],
+    "api_utils": ["matplotlib", "seaborn", "openai", "geopy", "pgeocode", "timezonefinder"],
+    "refresher": ["matplotlib", "seaborn", "openai", "dash"],
+    "main": ["seaborn", "openai", "geopy", "pgeocode", "timezonefinder"],
+}
+
+RUNS = 3
+
+# import time: self [us] | cumulative | imported package
+_IMPORT_LINE = re.compile(r"^import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)$")
+
+
+def import_times(module="sys"):
+    """
+    Imports module in a fresh interpreter with -X importtime
+
+    :return: dict of every module imported along the way, interpreter startup included, -> cumulative import
+        time in seconds
+    """
+    env = dict(os.environ, WEATHER_WARMUP="off")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            times[match.group(2)] = int(match.group(1)) / 1e6
+    return times
+
+
+def check(module, budget_ms, deferred, runs=RUNS, top=0):
+    """
+    Measures one module against its budget and deferred dependencies, printing the result
+
+    :return: True if the module is within budget
+    """
+    runs = [import_times(module) for _ in range(runs)]
+    best = min(runs, key=lambda times: times[module])
+    seconds = best[module]
+
+    loaded = [name for name in deferred if name in best]
+    ok = seconds * 1e3 <= budget_ms and not loaded
+
+    status = "ok" if ok else "FAIL"
+    print(f"{module:>10}: {seconds * 1e3:8.1f} ms of {budget_ms:5d} ms  {status}")
+    if loaded:
+        print(f"{'':>12}imports {', '.join(loaded)}, which should load on first use")
+    if top:
+        startup = import_times()
+        slowest = sorted((item for item in best.items() if item[0] != module and item[0] not in startup),
+                         key=lambda item: -item[1])
+        for name, dependency_seconds in slowest[:top]:
+            print(f"{'':>12}{dependency_seconds * 1e3:8.1f} ms  {name}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the import time of the dashboard's modules")
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS_MS), help="modules to check (default: all)")
+    parser.add_argument("--runs", type=int, default=RUNS, help="imports per module; the fastest one counts")
+    parser.add_argument("--top", type=int, default=0, help="list this many of each module's slowest imports")
+    args = parser.parse_args(argv)
+
+    results = [check(module, BUDGETS_MS[module], DEFERRED.get(module, []), args.runs, args.top)
+               for module in args.modules]
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,11 +1,134 @@
-from geopy.geocoders import Nominatim
+import os
+import threading
+import time
 import pandas as pd
-import requests
-from timezonefinder import TimezoneFinder
-import pgeocode
+import transport
+from solar import get_sun_times
+from store import get_db
+
+# Location shown before a visitor enters a zipcode, and used when none is given
+DEFAULT_ZIPCODE = "08057"
+
+# On-disk location store shared by every worker process, keyed by zipcode
+LOCATION_DB = os.environ.get("WEATHER_LOCATION_DB", "locations.db")
+LOCATION_SCHEMA = """CREATE TABLE IF NOT EXISTS locations (
+                        zipcode TEXT PRIMARY KEY,
+                        lat REAL NOT NULL,
+                        lng REAL NOT NULL,
+                        name TEXT,
+                        timezone TEXT)"""
+
+# Where sunrise/sunset come from: "solar" (local NOAA calculation) or "http" (sunrise-sunset.org)
+SUN_TIMES_BACKEND = os.environ.get("WEATHER_SUN_BACKEND", "solar")
+
+# Keep timezone polygons in RAM instead of reading them from disk on every lookup
+TZ_IN_MEMORY = os.environ.get("WEATHER_TZ_IN_MEMORY", "0") == "1"
 
 zipcode_cache = {}
 
+# Process-wide geocoding resources, loaded on first use
+_resource_lock = threading.Lock()
+_geocoder = None
+_timezone_finder = None
+# Seconds spent on the cold load of each resource, for tracking startup cost
+load_timings = {}
+
+
+def get_geocoder():
+    """
+    Returns the process-wide US postal code geocoder, importing pgeocode and loading its dataset on first call
+    """
+    global _geocoder
+    if _geocoder is None:
+        with _resource_lock:
+            if _geocoder is None:
+                start = time.perf_counter()
+                import pgeocode
+                _geocoder = pgeocode.Nominatim('us')
+                load_timings["geocoder"] = time.perf_counter() - start
+    return _geocoder
+
+
+def get_timezone_finder():
+    """
+    Returns the process-wide TimezoneFinder, importing it and loading its polygon data on first call
+    """
+    global _timezone_finder
+    if _timezone_finder is None:
+        with _resource_lock:
+            if _timezone_finder is None:
+                start = time.perf_counter()
+                from timezonefinder import TimezoneFinder
+                _timezone_finder = TimezoneFinder(in_memory=TZ_IN_MEMORY)
+                load_timings["timezone_finder"] = time.perf_counter() - start
+    return _timezone_finder
+
+
+def get_location_db():
+    """
+    Returns this thread's connection to the location store, creating the table on first use
+    """
+    return get_db(LOCATION_DB, LOCATION_SCHEMA)
+
+
+def lookup_location(zipcode):
+    """
+    Looks a zipcode up in the location store
+
+    :param zipcode: 5 digit US zipcode
+    :return: (lat, lng, name, timezone) or None if the zipcode has not been stored yet
+    """
+    row = get_location_db().execute("SELECT lat, lng, name, timezone FROM locations WHERE zipcode = ?",
+                                    (zipcode,)).fetchone()
+    return tuple(row) if row else None
+
+
+def store_locations(rows):
+    """
+    Writes (zipcode, lat, lng, name, timezone) rows to the location store, replacing existing entries
+    """
+    conn = get_location_db()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def build_location_store():
+    """
+    Pre-builds the location store for every US zipcode so workers never geocode at runtime
+
+    :return: number of stored zipcodes
+    """
+    data = get_geocoder()._data_frame.dropna(subset=["latitude", "longitude"])
+
+    tf = get_timezone_finder()
+    rows = [(zipcode, float(lat), float(lng), f"{place}, {state}", tf.certain_timezone_at(lat=lat, lng=lng))
+            for zipcode, lat, lng, place, state in zip(data["postal_code"], data["latitude"], data["longitude"],
+                                                        data["place_name"], data["state_name"])]
+    store_locations(rows)
+    return len(rows)
+
+
+def parse_sunrise_sunset(data):
+    """
+    Extracts sunrise and sunset times from a sunrise-sunset.org response
+
+    :param data: decoded json response
+    :return: (sunrise, sunset) as UTC Timestamps
+    """
+    sunrise = data["results"]["sunrise"]
+    sunset = data["results"]["sunset"]
+
+    sunrise = pd.to_datetime(sunrise)
+    sunset = pd.to_datetime(sunset)
+
+    return sunrise, sunset
+
+
+class LocationNotFoundError(ValueError):
+    """
+    Raised by weatherloc when a zipcode cannot be geocoded
+    """
+
 
 class weatherloc:
 
@@ -13,52 +136,51 @@ class weatherloc:
         self.zipcode = zipcode
 
         if zipcode in zipcode_cache:
-            self.lat, self.lng, self.name = zipcode_cache[zipcode]
+            self.lat, self.lng, self.name, self.timezone = zipcode_cache[zipcode]
         else:
-            # Call geocoding and timezone APIs
-            self.lat, self.lng, self.name = self.find_location_by_zip()
-
-        self.timezone = self.get_timezone()
-
-        # Add to cache
-        zipcode_cache[zipcode] = (self.lat, self.lng, self.name)
-
-
+            stored = lookup_location(zipcode)
+            if stored:
+                self.lat, self.lng, self.name, self.timezone = stored
+            else:
+                # Call geocoding and timezone APIs, then persist the result for other workers
+                self.lat, self.lng, self.name = self.find_location_by_zip()
+                if self.lat is None:
+                    # Failures are not cached, so the next request for this zipcode tries again
+                    raise LocationNotFoundError(f"Location not found for zip code: {zipcode}")
+                self.timezone = self.get_timezone()
+                store_locations([(zipcode, self.lat, self.lng, self.name, self.timezone)])
+
+            # Add to cache
+            zipcode_cache[zipcode] = (self.lat, self.lng, self.name, self.timezone)
 
     def find_location_by_zip(self):
         """
         Find latitude and longitude using zipcode
         """
         if self.zipcode in zipcode_cache:
-            return zipcode_cache[self.zipcode][0], zipcode_cache[self.zipcode][1]
+            return zipcode_cache[self.zipcode][:3]
         else:
             # Call geocoding API
             try:
-                nomi = pgeocode.Nominatim('us')
-                query = nomi.query_postal_code(self.zipcode)
+                query = get_geocoder().query_postal_code(self.zipcode)
 
                 lat = query["latitude"]
                 lng = query["longitude"]
                 name = f"{query['place_name']}, {query['state_name']}"
 
-                if lat:
-                   # Cache for future
-                   # zipcode_cache[self.zipcode] = (lat, lng, ...)
-                    zipcode_cache[self.zipcode] = (lat, lng, name)
-                    return lat, lng, name
+                if pd.notna(lat):
+                    return float(lat), float(lng), name
                 else:
                     print(f"Location not found for zip code: {self.zipcode}")
-                    return None, None
+                    return None, None, None
             except Exception as e:
                 print(f"Error: {e}")
-                return None, None
+                return None, None, None
 
     def get_timezone(self):
-        # if self.zipcode in zipcode_cache:
-        #     return zipcode_cache[self.zipcode][2]
-        # else:
-        tf = TimezoneFinder()
-        timezone = tf.certain_timezone_at(lat=self.lat, lng=self.lng)
+        if self.lat is None:
+            return None
+        timezone = get_timezone_finder().certain_timezone_at(lat=self.lat, lng=self.lng)
         return timezone
 
     def get_sunrise_sunset(self):
@@ -66,20 +188,37 @@ class weatherloc:
         Find sunrise and sunset time using latitude and longitude
         """
 
+        response = transport.get(self.sunrise_sunset_url())
+
+        return parse_sunrise_sunset(response.json())
+
+    def sunrise_sunset_url(self):
         latitude, longitude = self.lat, self.lng
 
-        api_url = f"https://api.sunrise-sunset.org/json?lat={latitude}&lng={longitude}&formatted=0"
+        return f"https://api.sunrise-sunset.org/json?lat={latitude}&lng={longitude}&formatted=0"
 
-        response = requests.get(api_url)
+    def get_sun_times(self, dates, backend=SUN_TIMES_BACKEND):
+        """
+        Find sunrise and sunset times for each of the given local dates
+
+        :param dates: local calendar dates (as midnight timestamps) to look up
+        :param backend: "solar" computes them locally; "http" asks sunrise-sunset.org, for verification only
+        :return: DataFrame indexed by date with sunrise and sunset columns in UTC
+        """
+        dates = pd.DatetimeIndex(dates).unique()
 
-        data = response.json()
+        if backend == "http":
+            sunrise, sunset = self.get_sunrise_sunset()
 
-        # Extract sunrise and sunset times from the response
-        sunrise = data["results"]["sunrise"]
-        sunset = data["results"]["sunset"]
+            # sunrise-sunset.org only answers for today, so today's times are shifted onto each requested day
+            today = sunrise.tz_convert(self.timezone).normalize().tz_localize(None)
+            offsets = dates - today
+            return pd.DataFrame({"sunrise": sunrise + offsets, "sunset": sunset + offsets}, index=dates)
 
-        sunrise = pd.to_datetime(sunrise)
-        sunset = pd.to_datetime(sunset)
+        sunrise, sunset = get_sun_times(self.lat, self.lng, dates.to_numpy())
+        return pd.DataFrame({"sunrise": pd.to_datetime(sunrise, utc=True),
+                             "sunset": pd.to_datetime(sunset, utc=True)}, index=dates)
 
-        return sunrise, sunset
 
+if __name__ == '__main__':
+    print(f"Stored {build_location_store()} zipcodes in {LOCATION_DB}")
@@ -1,21 +1,27 @@
 import pandas as pd
-from location import weatherloc
+from location import DEFAULT_ZIPCODE, LocationNotFoundError, weatherloc
 import pytz
-import pickle
 from weathercode import weatherCode
-from aux_viz import arrow_pos, gauge, generate_wind_rose, get_forecast_fig
+from aux_viz import (FIGURE_ICON_VARIANT, WIND_ROSE_RENDERER, arrow_pos, forecast_fig_patch, gauge,
+                     generate_wind_rose, placeholder_forecast_fig)
 import plotly.graph_objects as go
 import dash
 from dash import dcc
 import base64
-from datetime import datetime
+import os
+from concurrent import futures
+import threading
+import time
 import dash_bootstrap_components as dbc
 from dash import Input, Output, State, html
 from dash_bootstrap_components._components.Container import Container
 import re
-from clothes import clothesRecommender
+from clothes import REC_TIMEOUT, clothesRecommender
 from components import get_card, get_badge
-from api_utils import api_call, convert_to_df, convert_to_local_time, process_data, add_desc, get_image_names
+from icons import icon_index_for, icon_source, register_icon_route
+from refresher import refreshScheduler
+from api_utils import (api_call, convert_to_df, convert_to_local_time, process_data, add_desc, get_image_names,
+                       submit_timed)
 from config import OPENAI_API_KEY, TOMORROW_IO_API_KEY
 
 # Style Specifications
@@ -36,10 +42,14 @@ card_style = {
     'backgroundColor': '#AEDFF7',  # Keeping the original background color
 }
 
-# Importing png files scraped from Github with scrape_icons.py
-with open('data.pkl', 'rb') as f:
-    loaded_data = pickle.load(f)
-    png_files = loaded_data
+# The wind rose is a figure with the plotly renderer and an image with the png one
+WIND_ROSE_PROPERTY = 'figure' if WIND_ROSE_RENDERER == 'plotly' else 'src'
+
+
+def wind_rose_component(wind_rose_fig=None):
+    if WIND_ROSE_PROPERTY == 'figure':
+        return dcc.Graph(id='wind-rose', figure=wind_rose_fig or {}, config={'displayModeBar': False})
+    return html.Img(id='wind-rose', src=wind_rose_fig)
 
 
 def is_valid_zip(zip_code):
@@ -48,110 +58,218 @@ def is_valid_zip(zip_code):
     return bool(re.match(pattern, zip_code))
 
 
+def load_weather(location_obj):
+    """
+    Fetches realtime and forecast data concurrently and starts the LLM clothing recommendation as soon as the
+    realtime conditions arrive, so a refresh takes about as long as its slowest call rather than the sum. The
+    recommendation returned is the cached LLM advice for these conditions, or else the rule-based one.
+
+    :param location_obj: weatherloc to load
+    :return: now_data_dict, now_data_df, forecast_data_df, the recommendation, the inputs of the LLM recommendation
+        for enrich_recommendation (None if it was cached), and per-stage timings
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    now_future = submit_timed(timings, "now", api_call, time_period="now", time_step="1h", units=unit_selected,
+                              wlo=location_obj)
+    forecast_future = submit_timed(timings, "forecast", api_call, time_period="forecast", time_step="1h",
+                                   units=unit_selected, wlo=location_obj)
+    # Warms the sun times of the forecast days while the API calls are in flight
+    today = pd.Timestamp.now(tz=location_obj.timezone).normalize().tz_localize(None)
+    sun_future = submit_timed(timings, "sun_times", location_obj.get_sun_times, pd.date_range(today, periods=6))
+
+    now_data = now_future.result().json()
+    now_data_dict = now_data['data']['values']
+    now_data_df = pd.DataFrame([now_data_dict])
+    now_data_df["time"] = now_data['data']['time']
+    now_data_df = process_data(now_data_df, location_obj)
+
+    # The recommendation only depends on realtime conditions, so the LLM call overlaps with forecast processing and
+    # rendering; the page shows rule-based advice until enrich_recommendation swaps the LLM's in
+    rec_conditions = dict(
+        temp=now_data_dict['temperature'],
+        feels_like=now_data_dict['temperatureApparent'],
+        rain=now_data_dict['precipitationProbability'],
+        humid=now_data_dict['humidity'],
+        uv=now_data_dict['uvIndex'],
+        wind=now_data_dict['windSpeed'],
+        description=weatherCode[str(now_data_df['weatherCode'][0])]
+    )
+    recommendation = recommender.cached_response(**rec_conditions)
+    if recommendation is None:
+        recommendation = recommender.local_response(**rec_conditions)
+        start_recommendation(rec_conditions)
+    else:
+        rec_conditions = None
+
+    sun_future.result()
+    forecast_data_df = convert_to_df(forecast_future.result().content)
+    forecast_data_df = process_data(forecast_data_df, location_obj)
+    forecast_data_df = add_desc(forecast_data_df)
+    forecast_data_df["image_names"] = get_image_names(forecast_data_df)
+    # formatting time
+    forecast_data_df['local_time'] = forecast_data_df['local_time'].dt.strftime("%I:%M %p")
+
+    timings["load"] = time.perf_counter() - start
+    return now_data_dict, now_data_df, forecast_data_df, recommendation, rec_conditions, timings
+
+
 # Set values for API Call parameters
-location_obj = weatherloc("08057")
 unit_selected = "imperial"
 
-try:
-    now = api_call(time_period="now", time_step="1h", units=unit_selected, wlo=location_obj)
-    forecast = api_call(time_period="forecast", time_step="1h", units=unit_selected, wlo=location_obj)
-except:
-    print("API call failed", "", {}, "", "")
-
-# Extract hourly data from the the JSON
-# historical_data = last_24_hours.json()
-now_data = now.json()
-forecast_data = forecast.json()
-
-# Convert Realtime Weather to Dictionary
-now_data_dict = now_data['data']['values']
-
-# Convert Historical and Forecast Data to Pandas Df
-# historical_data_df = convert_to_df(historical_data)
-forecast_data_df = convert_to_df(forecast_data)
-
-
-# historical_data_df = process_data(historical_data_df, location_obj)
-forecast_data_df = process_data(forecast_data_df, location_obj)
-
-# historical_data_df = add_desc(historical_data_df)
-forecast_data_df = add_desc(forecast_data_df)
-
-#add 
-forecast_data_df["image_names"] = get_image_names(forecast_data_df)
-
-# UV Index Dial
-uvIndex = now_data_dict['uvIndex']
-arrow_num = arrow_pos(uvIndex)
-
-if arrow_num == 1:
-    uv_desc = 'Minimal Danger'
-elif arrow_num == 2:
-    uv_desc = 'Low Risk'
-elif arrow_num == 3:
-    uv_desc = 'Moderate Risk'
-elif arrow_num == 4:
-    uv_desc = 'High Risk'
-elif arrow_num == 5:
-    uv_desc = 'Very High Risk'
-else:
-    uv_desc = ""
-
-gauge_fig = dcc.Graph(id='gauge-plot',
-                      figure={
-                          'layout': {
-                              'width': 150,
-                              'height': 150,
-                              'images': [{'source': gauge(labels=['0-2', '3-5', '6-7', '8-10', '11+'],
-                                                          colors=['#299501', '#f7e401', '#f95901', '#d90011',
-                                                                  '#6c49cb'],
-                                                          arrow=arrow_num,
-                                                          title=f'{uv_desc}')}],
-                              'showlegend': False, }})
-
-# formatting time
-forecast_data_df['local_time'] = forecast_data_df.apply(lambda row: row["local_time"].strftime("%I:%M %p"), axis=1)
-
-next_day = forecast_data_df[:24]
-
-now_data_df = pd.DataFrame([now_data_dict])
-now_data_df["time"] = datetime.now().strftime('%H:%M:%S')
-now_data_df = process_data(now_data_df)
-
 # Instantiate the clothesRecommender class
 recommender = clothesRecommender(OPENAI_API_KEY)
 
-recommendation = recommender.get_gpt4_response(
-    temp=now_data_dict['temperature'],
-    feels_like=now_data_dict['temperatureApparent'],
-    rain=now_data_dict['precipitationProbability'],
-    humid=now_data_dict['humidity'],
-    uv=now_data_dict['uvIndex'],
-    wind=now_data_dict['windSpeed'],
-    description=weatherCode[str(now_data_df['weatherCode'][0])]
-)
-
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# LLM calls get their own small pool, so slow answers never hold up the weather fetches on fetch_executor.
+# Beyond REC_MAX_PENDING calls queued or running, visitors keep the rule-based advice.
+REC_WORKERS = int(os.environ.get("WEATHER_REC_WORKERS", 4))
+REC_MAX_PENDING = 4 * REC_WORKERS
+rec_executor = futures.ThreadPoolExecutor(max_workers=REC_WORKERS, thread_name_prefix="weather-rec")
+_rec_pending = {}  # recommendation cache key -> Future of the LLM call running for it
+_rec_lock = threading.Lock()
 
-app.config.suppress_callback_exceptions = True
+# Per-stage timings of the most recent refresh
+last_refresh_timings = {}
 
-# Set the throttling delay in seconds (every hour)
+# Set the throttling delay in seconds (every hour): how long a location is kept fresh after its last request
 throttle_delay = 3600
-now = datetime.now()
-current_time = now.strftime("%H:%M")
-current_temperature = now_data_dict['temperature']
 
-# fig.update_layout(showlegend=False)
+# Refreshes the API responses of recently requested locations before they expire
+refresher = refreshScheduler(track_window=throttle_delay, units=unit_selected)
+
+# Shown in the cards until the first load for the page completes
+PLACEHOLDER = "--"
+
+# "background" warms the caches on a thread when the process serves its first request, "sync" before create_app
+# returns (use it with gunicorn --preload so every forked worker starts with them warm), "off" skips warming
+WARMUP = os.environ.get("WEATHER_WARMUP", "background")
+_warmup_pid = None
+_warmup_lock = threading.Lock()
+
+
+def start_recommendation(rec_conditions):
+    """
+    Starts the LLM recommendation for the conditions on rec_executor, unless a call for the same cache key is
+    already running
+
+    :return: Future of the recommendation, or None if REC_MAX_PENDING calls are already pending
+    """
+    key = recommender.cache.key(**rec_conditions)
+    with _rec_lock:
+        future = _rec_pending.get(key)
+        if future is not None or len(_rec_pending) >= REC_MAX_PENDING:
+            return future
+        future = _rec_pending[key] = rec_executor.submit(recommender.get_gpt4_response, **rec_conditions)
+
+    def finished(done):
+        with _rec_lock:
+            if _rec_pending.get(key) is done:
+                del _rec_pending[key]
+
+    future.add_done_callback(finished)
+    return future
+
+
+def preload_static_assets():
+    """
+    Renders what is the same for every location up front: the UV gauges and the data URIs of the forecast icons.
+    Under gunicorn --preload this runs once in the master and the workers share the results copy-on-write.
+    """
+    for arrow in range(1, 5):
+        gauge(arrow=arrow)
+    for name in set(icon_index_for(FIGURE_ICON_VARIANT).values()):
+        icon_source(name)
+
+
+def warm_up(zipcode=DEFAULT_ZIPCODE):
+    """
+    Loads a zipcode once so the first visitor finds the location, API responses, sun times and renders cached.
+    Everything runs on the calling thread, not the fetch pool, so it is safe to run before gunicorn forks, and a
+    failure is only printed: the app still starts when an upstream API is down. No recommendation is requested.
+    """
+    start = time.perf_counter()
+    try:
+        location_obj = weatherloc(zipcode)
+        api_call(time_period="now", time_step="1h", units=unit_selected, wlo=location_obj)
+        response = api_call(time_period="forecast", time_step="1h", units=unit_selected, wlo=location_obj)
+        forecast_data_df = process_data(convert_to_df(response.content), location_obj)
+        generate_wind_rose(forecast_data_df)
+    except Exception as e:
+        print(f"Warm-up for {zipcode} failed: {e}")
+        return
+    print(f"Warmed up {zipcode} in {time.perf_counter() - start:.2f} s")
+
+
+def start_warm_up():
+    """
+    Starts warm_up on a daemon thread, once per process. It runs on the first request rather than in create_app,
+    like the refresher: a thread still fetching when gunicorn --preload forks would leave every worker waiting
+    forever on the api_cache fetch it had in flight.
+    """
+    global _warmup_pid
+    with _warmup_lock:
+        if _warmup_pid == os.getpid():
+            return
+        _warmup_pid = os.getpid()
+    threading.Thread(target=warm_up, name="weather-warmup", daemon=True).start()
+
+
+def measure_ttfb(app, paths=("/", "/_dash-layout")):
+    """
+    Times the first response to each path through the Flask test client: server-side time to first byte,
+    without network latency
+
+    :return: dict of path -> seconds
+    """
+    client = app.server.test_client()
+    ttfb = {}
+    for path in paths:
+        start = time.perf_counter()
+        client.get(path).close()
+        ttfb[path] = time.perf_counter() - start
+    return ttfb
+
+
+def create_app(warmup=WARMUP):
+    """
+    Builds the Dash app without any network call: the layout only holds placeholders, so workers boot instantly
+    and even when an upstream API is down. Data arrives through the zipcode callback when a page loads.
+
+    :param warmup: "background", "sync" or "off", see WARMUP
+    :return: dash.Dash app
+    """
+    start = time.perf_counter()
+    app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+    app.config.suppress_callback_exceptions = True
+    app.layout = build_layout()
+    register_callbacks(app)
+    register_icon_route(app.server)
+
+    preload_static_assets()
+    if warmup == "sync":
+        warm_up()
+
+    # Only armed after measure_ttfb, whose requests would otherwise start it in this process before a fork
+    ready = threading.Event()
+
+    @app.server.before_request
+    def warm_up_on_first_request():
+        if warmup == "background" and ready.is_set():
+            start_warm_up()
+
+    ttfb = measure_ttfb(app)
+    ready.set()
+    print(f"App ready in {time.perf_counter() - start:.2f} s; TTFB " +
+          ", ".join(f"{path} {seconds * 1e3:.1f} ms" for path, seconds in ttfb.items()))
+    return app
 
-initial_value = arrow_num  # Change this to the initial value you want
-gauge_fig = gauge(arrow=initial_value)
-wind_rose_uri = generate_wind_rose(forecast_data_df)
 
 LOGO = "https://cdn-icons-png.flaticon.com/512/10127/10127236.png"
 
 search_bar = dbc.Row(
     [
-        dbc.Col(dcc.Input(id='zipcode-input', type='text', placeholder='Enter zipcode', value='08057')),
+        dbc.Col(dcc.Input(id='zipcode-input', type='text', placeholder='Enter zipcode', value=DEFAULT_ZIPCODE)),
         dbc.Col(
             dbc.Button(
                 "Search", color="primary", className="ms-2", n_clicks=0
@@ -197,225 +315,196 @@ navbar = dbc.Navbar(
 #     'backgroundColor': '#AEDFF7',
 # }
 
-app.layout = dbc.Container([
-    navbar,
-
-    html.Hr(),
-
-    dbc.Row([
-        dbc.Col([
-            get_card([
-                html.H2(id='current_temp', children=f"{location_obj.name}: {current_temperature}°F"),
-                get_badge(id='current_desc', text=f"{weatherCode[str(now_data_df['weatherCode'][0])]}"),
-            ], className="h-100"),
-        ], width=6),
-        dbc.Col([
-            get_card([
-                html.H4([
-                    html.Img(
-                        src='https://www.clipartmax.com/png/middle/433-4330520_operating-dry-clothes-comments-clothes-icon-png-free.png',
-                        alt='Clothes Icon',
-                        style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                               'margin-right': '5px'}),
-                    "What to Wear"
+def build_layout():
+    """
+    Page layout with placeholders; the zipcode callback fills them in when the page loads
+    """
+    return dbc.Container([
+        navbar,
+
+        html.Hr(),
+
+        dbc.Row([
+            dbc.Col([
+                get_card([
+                    html.H2(id='current_temp', children="Loading..."),
+                    get_badge(id='current_desc', text=PLACEHOLDER),
+                ], className="h-100"),
+            ], width=6),
+            dbc.Col([
+                get_card([
+                    html.H4([
+                        html.Img(
+                            src='https://www.clipartmax.com/png/middle/433-4330520_operating-dry-clothes-comments-clothes-icon-png-free.png',
+                            alt='Clothes Icon',
+                            style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                   'margin-right': '5px'}),
+                        "What to Wear"
+                    ]),
+                    html.P(id='current_rec', children=PLACEHOLDER),
+                    # Inputs of the pending LLM recommendation, set by the zipcode callback
+                    dcc.Store(id='rec-conditions'),
+                ], className="h-100")
+            ], width=6)
+        ], className='mb-4'),
+
+        html.Hr(),
+        html.H3("Current Conditions"),
+        dbc.Row([
+            dbc.Col([
+                get_card([
+                    html.H4([
+                        html.Img(src='https://cdn-icons-png.flaticon.com/512/263/263883.png ', alt='Rain Icon',
+                                 style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "Precipitation"
+                    ]),
+                    html.P(id='current_precip', children=PLACEHOLDER)
                 ]),
-                html.P(id='current_rec', children=recommendation),
-            ], className="h-100")
-        ], width=6)
-    ], className='mb-4'),
-
-    html.Hr(),
-    html.H3("Current Conditions"),
-    dbc.Row([
-        dbc.Col([
-            get_card([
-                html.H4([
-                    html.Img(src='https://cdn-icons-png.flaticon.com/512/263/263883.png ', alt='Rain Icon',
-                             style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "Precipitation"
+                get_card([
+                    html.H4([
+                        html.Img(src='https://static-00.iconduck.com/assets.00/temperature-feels-like-icon-495x512'
+                                     '-ylzv705f.png', alt='Feels Like Icon',
+                                 style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "Feels Like"
+                    ]),
+                    html.P(id='current_temp_app', children=PLACEHOLDER)
                 ]),
-                html.P(id='current_precip', children=f"{now_data_dict['precipitationProbability']}%")
-            ]),
-            get_card([
-                html.H4([
-                    html.Img(src='https://static-00.iconduck.com/assets.00/temperature-feels-like-icon-495x512'
-                                 '-ylzv705f.png', alt='Feels Like Icon',
-                             style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "Feels Like"
+                get_card([
+                    html.H4([
+                        html.Img(src='https://cdn-icons-png.flaticon.com/512/6393/6393411.png', alt='Humidity Icon',
+                                 style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "Humidity"
+                    ])
+                    ,
+                    html.P(id='current_humid', children=PLACEHOLDER)
                 ]),
-                html.P(id='current_temp_app', children=f"{now_data_dict['temperatureApparent']}°F")
-            ]),
-            get_card([
-                html.H4([
-                    html.Img(src='https://cdn-icons-png.flaticon.com/512/6393/6393411.png', alt='Humidity Icon',
-                             style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "Humidity"
+                get_card([
+                    html.H4([
+                        html.Img(id='gauge-plot', src=None, alt='UV Index Icon',
+                                 style={'width': '30px', 'height': '30px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "UV Index"
+                    ]),
+                    html.P(id='current_uv', children=PLACEHOLDER)
+                ]),
+                get_card([
+                    html.H4([
+                        html.Img(src='https://cdn-icons-png.flaticon.com/512/252/252035.png', alt='Cloud Cover Icon',
+                                 style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "Cloud Cover"
+                    ]),
+                    html.P(id='current_cloudcover', children=PLACEHOLDER)
                 ])
-                ,
-                html.P(id='current_humid', children=f"{now_data_dict['humidity']}%")
             ]),
-            get_card([
-                html.H4([
-                    html.Img(id='gauge-plot', src=gauge_fig, alt='UV Index Icon',
-                             style={'width': '30px', 'height': '30px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "UV Index"
+            dbc.Col([
+                get_card([
+                    html.H4([
+                        html.Img(src='https://cdn-icons-png.flaticon.com/512/54/54298.png', alt='Wind Gust Icon',
+                                 style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "Wind Gust"
+                    ]),
+                    html.P(id='current_windGust', children=PLACEHOLDER)
                 ]),
-                html.P(id='current_uv', children=f"{now_data_dict['uvIndex']}")
-            ]),
-            get_card([
-                html.H4([
-                    html.Img(src='https://cdn-icons-png.flaticon.com/512/252/252035.png', alt='Cloud Cover Icon',
-                             style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "Cloud Cover"
+                get_card([
+                    html.H4([
+                        html.Img(src='https://cdn-icons-png.flaticon.com/512/740/740832.png', alt='Wind Speed Icon',
+                                 style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "Wind Speed"
+                    ]),
+                    html.P(id='current_windSpeed', children=PLACEHOLDER)
                 ]),
-                html.P(id='current_cloudcover', children=f"{now_data_dict['cloudCover']} %")
-            ])
-        ]),
-        dbc.Col([
-            get_card([
-                html.H4([
-                    html.Img(src='https://cdn-icons-png.flaticon.com/512/54/54298.png', alt='Wind Gust Icon',
-                             style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "Wind Gust"
+                get_card([
+                    html.H4([
+                        html.Img(src='https://cdn-icons-png.flaticon.com/512/4655/4655946.png', alt='Dew Point Icon',
+                                 style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "Dew Point"
+                    ]),
+                    html.P(id='current_dewPoint', children=PLACEHOLDER)
                 ]),
-                html.P(id='current_windGust', children=f"{now_data_dict['windGust']} mph")
-            ]),
-            get_card([
-                html.H4([
-                    html.Img(src='https://cdn-icons-png.flaticon.com/512/740/740832.png', alt='Wind Speed Icon',
-                             style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "Wind Speed"
+                get_card([
+                    html.H4([
+                        html.Img(src='https://cdn-icons-png.flaticon.com/512/1839/1839341.png', alt='Pressure Icon',
+                                 style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "Pressure"
+                    ]),
+                    html.P(id='current_pressure', children=PLACEHOLDER)
                 ]),
-                html.P(id='current_windSpeed', children=f"{now_data_dict['windSpeed']} mph")
-            ]),
-            get_card([
-                html.H4([
-                    html.Img(src='https://cdn-icons-png.flaticon.com/512/4655/4655946.png', alt='Dew Point Icon',
-                             style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "Dew Point"
-                ]),
-                html.P(id='current_dewPoint', children=f"{now_data_dict['dewPoint']}°F")
-            ]),
-            get_card([
-                html.H4([
-                    html.Img(src='https://cdn-icons-png.flaticon.com/512/1839/1839341.png', alt='Pressure Icon',
-                             style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "Pressure"
-                ]),
-                html.P(id='current_pressure', children=f"{now_data_dict['pressureSurfaceLevel']} inHg")
+                get_card([
+                    html.H4([
+                        html.Img(src='https://cdn-icons-png.flaticon.com/512/4005/4005908.png', alt='Visibility Icon',
+                                 style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
+                                        'margin-right': '5px'}),
+                        "Visibility"
+                    ]),
+                    html.P(id='current_visibility', children=PLACEHOLDER)
+                ])
             ]),
-            get_card([
-                html.H4([
-                    html.Img(src='https://cdn-icons-png.flaticon.com/512/4005/4005908.png', alt='Visibility Icon',
-                             style={'width': '20px', 'height': '20px', 'vertical-align': 'middle',
-                                    'margin-right': '5px'}),
-                    "Visibility"
-                ]),
-                html.P(id='current_visibility', children=f"{now_data_dict['visibility']} mi")
+        ], style={'fontFamily': 'Lato, sans-serif'}),
+
+        html.Hr(),
+
+        dbc.Row([
+            dbc.Col([
+                html.H3("24 Hour Forecast"),
+                dcc.Graph(id='forecast-plot', figure=placeholder_forecast_fig(),
+                          style={
+                              'textAlign': 'center',  # Horizontal centering
+                              'display': 'flex',
+                              'justifyContent': 'center',  # Horizontal centering with flex
+                              'alignItems': 'center'  # Vertical centering with flex
+                          })
             ])
         ]),
-    ], style={'fontFamily': 'Lato, sans-serif'}),
-
-    html.Hr(),
-
-    dbc.Row([
-        dbc.Col([
-            html.H3("24 Hour Forecast"),
-            dcc.Graph(id='forecast-plot', figure=get_forecast_fig(next_day),
-                      style={
-                          'textAlign': 'center',  # Horizontal centering
-                          'display': 'flex',
-                          'justifyContent': 'center',  # Horizontal centering with flex
-                          'alignItems': 'center'  # Vertical centering with flex
-                      })
-        ])
-    ]),
 
-    html.Hr(),
+        html.Hr(),
 
-    dbc.Row([
-        dbc.Col([
-            get_card([
-                html.H3("Wind Rose"),
-                html.P("Shows the distribution of wind direction and speed in the next 24 hours"),
-                html.Img(id='wind-rose-image', src=wind_rose_uri)
-            ])
-        ], width=6)
+        dbc.Row([
+            dbc.Col([
+                get_card([
+                    html.H3("Wind Rose"),
+                    html.P("Shows the distribution of wind direction and speed in the next 24 hours"),
+                    wind_rose_component()
+                ])
+            ], width=6)
 
-    ])
-], style={
-    'backgroundColor': color_palette['dark_blue'],
-    'color': color_palette['off_white']
-}, fluid=True)
+        ])
+    ], style={
+        'backgroundColor': color_palette['dark_blue'],
+        'color': color_palette['off_white']
+    }, fluid=True)
 
 
-# add callback for toggling the collapse on small screens
-@app.callback(
-    Output("navbar-collapse", "is_open"),
-    [Input("navbar-toggler", "n_clicks")],
-    [State("navbar-collapse", "is_open")],
-)
 def toggle_navbar_collapse(n, is_open):
     if n:
         return not is_open
     return is_open
 
 
-@app.callback(
-    [
-        Output('current_temp', 'children'),
-        Output('current_desc', 'children'),
-        Output('current_precip', 'children'),
-        Output('current_temp_app', 'children'),
-        Output('current_humid', 'children'),
-        Output('current_uv', 'children'),
-        Output('current_windGust', 'children'),
-        Output('current_windSpeed', 'children'),
-        Output('current_dewPoint', 'children'),
-        Output('current_pressure', 'children'),
-        Output('current_cloudcover', 'children'),
-        Output('current_visibility', 'children'),
-        Output('forecast-plot', 'figure'),
-        Output('wind-rose-image', 'src'),
-        Output('gauge-plot', 'src'),
-        Output('current_rec', 'children')
-    ],
-    Input('zipcode-input', 'value'),
-    prevent_initial_call=True
-)
 def update_based_on_zipcode(zipcode_value):
     if not is_valid_zip(zipcode_value):
         return dash.no_update
     else:
-        location_obj = weatherloc(zipcode_value)
-
-        # Make API calls using location_obj
+        refresh_start = time.perf_counter()
+        # Fetch realtime and forecast data concurrently using location_obj
         try:
-            now = api_call(time_period="now", time_step="1h", units=unit_selected, wlo=location_obj)
-            forecast = api_call(time_period="forecast", time_step="1h", units=unit_selected, wlo=location_obj)
-        except:
-            return "API call failed", "", {}, "", ""
-
-        # Extract and process data
-        now_data = now.json()
-        forecast_data = forecast.json()
-
-        now_data_dict = now_data['data']['values']
-        forecast_data_df = convert_to_df(forecast_data)
-        forecast_data_df["image_names"] = get_image_names(forecast_data_df)
-        forecast_data_df = process_data(forecast_data_df, location_obj)
-        forecast_data_df = add_desc(forecast_data_df)
-        forecast_data_df['local_time'] = forecast_data_df.apply(lambda row: row["local_time"].strftime("%I:%M %p"),
-                                                                axis=1)
+            location_obj = weatherloc(zipcode_value)
+            refresher.touch(location_obj)
+            (now_data_dict, now_data_df, forecast_data_df, recommendation, rec_conditions,
+             timings) = load_weather(location_obj)
+        except LocationNotFoundError as e:
+            print(e)
+            return (str(e),) + (dash.no_update,) * 15 + (None,)
+        except Exception as e:
+            print(f"Loading {zipcode_value} failed: {e}")
+            return ("API call failed",) + (dash.no_update,) * 15 + (None,)
 
         # Extract necessary values for components
         current_temp = f"{location_obj.name}: {now_data_dict['temperature']}°F"
@@ -431,26 +520,98 @@ def update_based_on_zipcode(zipcode_value):
         current_cloudcover = f"{now_data_dict['cloudCover']} %"
         current_visibility = f"{now_data_dict['visibility']} mi"
 
-        forecast_figure = get_forecast_fig(forecast_data_df[:24])
-        wind_rose_uri = generate_wind_rose(forecast_data_df)
+        render_start = time.perf_counter()
+        # The 24 hour figure is already displayed; only send what changes with the location
+        forecast_figure = forecast_fig_patch(forecast_data_df[:24])
+        wind_rose_fig = generate_wind_rose(forecast_data_df)
         uvIndex = now_data_dict['uvIndex']
         arrow_num = arrow_pos(uvIndex)
         gauge_fig = gauge(arrow=arrow_num)  # You might need to adjust this based on your gauge function
+        timings["render"] = time.perf_counter() - render_start
 
-        recommendation = recommender.get_gpt4_response(
-            temp=now_data_dict['temperature'],
-            feels_like=now_data_dict['temperatureApparent'],
-            rain=now_data_dict['precipitationProbability'],
-            humid=now_data_dict['humidity'],
-            uv=now_data_dict['uvIndex'],
-            wind=now_data_dict['windSpeed'],
-            description=weatherCode[str(now_data_df['weatherCode'][0])]
-        )
+        timings["total"] = time.perf_counter() - refresh_start
+        last_refresh_timings.clear()
+        last_refresh_timings.update(timings)
 
+        # Every load writes rec-conditions, None when there is nothing to enrich, so an enrichment still waiting
+        # for the previous location is replaced and its advice cannot land on this one
         return (current_temp, current_desc, current_precip, current_temp_app, current_humid, current_uv,
                 current_windGust, current_windSpeed, current_dewPoint, current_pressure, current_cloudcover,
-                current_visibility, forecast_figure, wind_rose_uri, gauge_fig, recommendation)
+                current_visibility, forecast_figure, wind_rose_fig, gauge_fig, recommendation,
+                rec_conditions)
+
+
+def enrich_recommendation(rec_conditions):
+    """
+    Replaces the rule-based advice with the LLM's. Runs as its own request after the dashboard has rendered and
+    waits on the call load_weather started, or starts one when this worker has none. When the API fails or takes
+    longer than REC_TIMEOUT, the rule-based advice stays; a slow call keeps running and its answer is cached for
+    the next visit.
+    """
+    if not rec_conditions:
+        return dash.no_update
+    recommendation = recommender.cached_response(**rec_conditions)
+    if recommendation is not None:
+        return recommendation
 
+    future = start_recommendation(rec_conditions)
+    if future is None:
+        print("Too many recommendations pending; keeping the rule-based one")
+        return dash.no_update
+    try:
+        return future.result(timeout=REC_TIMEOUT)
+    except futures.TimeoutError:
+        print(f"No recommendation within {REC_TIMEOUT} s; keeping the rule-based one")
+    except Exception as e:
+        print(f"Recommendation failed, keeping the rule-based one: {e}")
+    return dash.no_update
+
+
+def register_callbacks(app):
+    """
+    Registers the dashboard's callbacks on app. They are attached to the app rather than through dash.callback,
+    whose global registry is handed to whichever app serves a request first, so every create_app() gets them.
+    """
+    # add callback for toggling the collapse on small screens
+    app.callback(
+        Output("navbar-collapse", "is_open"),
+        [Input("navbar-toggler", "n_clicks")],
+        [State("navbar-collapse", "is_open")],
+    )(toggle_navbar_collapse)
+
+    app.callback(
+        [
+            Output('current_temp', 'children'),
+            Output('current_desc', 'children'),
+            Output('current_precip', 'children'),
+            Output('current_temp_app', 'children'),
+            Output('current_humid', 'children'),
+            Output('current_uv', 'children'),
+            Output('current_windGust', 'children'),
+            Output('current_windSpeed', 'children'),
+            Output('current_dewPoint', 'children'),
+            Output('current_pressure', 'children'),
+            Output('current_cloudcover', 'children'),
+            Output('current_visibility', 'children'),
+            Output('forecast-plot', 'figure'),
+            Output('wind-rose', WIND_ROSE_PROPERTY),
+            Output('gauge-plot', 'src'),
+            Output('current_rec', 'children'),
+            Output('rec-conditions', 'data')
+        ],
+        Input('zipcode-input', 'value')
+    )(update_based_on_zipcode)
+
+    app.callback(
+        Output('current_rec', 'children', allow_duplicate=True),
+        Input('rec-conditions', 'data'),
+        prevent_initial_call=True
+    )(enrich_recommendation)
+
+
+app = create_app()
+# WSGI entry point, e.g. gunicorn --preload main:server with WEATHER_WARMUP=sync
+server = app.server
 
 if __name__ == '__main__':
-    app.run_server(debug=True)
+    app.run(debug=True)
@@ -0,0 +1,103 @@
+"""
+Local stand-in for the OpenAI chat completions API, for running the dashboard and benchmarks offline.
+
+    python openai_stub.py --port 8001 --delay 0.5
+    OPENAI_API_BASE=http://127.0.0.1:8001/v1 python main.py
+
+Every POST to /v1/chat/completions gets a fixed recommendation after the configured delay, or the configured error
+status. Requests are counted so callers can check how many calls reached the API.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_RECOMMENDATION = "Wear comfortable layers you can adjust as the day goes on."
+
+
+class openaiStub(ThreadingHTTPServer):
+    """
+    HTTP server answering chat completion requests; delay, status and reply can be changed while it runs
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, delay=0.0, status=200, reply=STUB_RECOMMENDATION):
+        """
+        :param port: port to listen on, 0 for any free one
+        :param delay: seconds to wait before answering
+        :param status: HTTP status of the answers; anything but 200 returns an OpenAI-style error
+        :param reply: content of the assistant message
+        """
+        super().__init__(("127.0.0.1", port), _stubHandler)
+        self.delay = delay
+        self.status = status
+        self.reply = reply
+        self.requests = 0
+
+    @property
+    def api_base(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self):
+        """
+        Serves on a daemon thread
+
+        :return: self
+        """
+        threading.Thread(target=self.serve_forever, name="openai-stub", daemon=True).start()
+        return self
+
+
+class _stubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        server.requests += 1
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(server.delay)
+
+        if self.path.rstrip("/").endswith("/chat/completions") and server.status == 200:
+            body = {
+                "id": f"chatcmpl-stub-{server.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-3.5-turbo"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": server.reply},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+            status = 200
+        else:
+            status = server.status if server.status != 200 else 404
+            body = {"error": {"message": f"stub error {status}", "type": "server_error", "code": None}}
+
+        payload = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up waiting, e.g. after its request_timeout
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a stub of the OpenAI chat completions API")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before each answer")
+    parser.add_argument("--status", type=int, default=200, help="HTTP status to answer with")
+    args = parser.parse_args(argv)
+
+    server = openaiStub(args.port, args.delay, args.status)
+    print(f"Serving OpenAI stub at {server.api_base}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Background refresh of the Tomorrow.io responses of popular locations. Every zipcode the dashboard serves is tracked
+for a while after its last request, and a scheduler thread fetches its realtime and forecast responses again shortly
+before their api_cache entries expire, so repeat visitors keep hitting fresh entries instead of waiting on the API.
+
+Refresh times are spread with random jitter and capped by a token bucket of MAX_REFRESH_PER_HOUR, since refreshes
+share the Tomorrow.io quota with interactive requests. When the budget runs out, entries expire and api_call serves
+them stale while it revalidates them. The budget is per process: divide the quota by the number of workers.
+
+The thread starts on the first touch(), so under gunicorn --preload it runs in each worker, never in the master.
+"""
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from api_utils import api_cache, api_refresh, build_request
+
+# Refreshes allowed per hour, and how many of them may run back to back
+MAX_REFRESH_PER_HOUR = float(os.environ.get("WEATHER_REFRESH_PER_HOUR", 20))
+REFRESH_BURST = 3
+# Locations tracked at once; the least recently requested one is dropped beyond this
+MAX_LOCATIONS = int(os.environ.get("WEATHER_REFRESH_LOCATIONS", 50))
+# An entry is refreshed between (LEAD + JITTER) and LEAD of its TTL before it expires
+REFRESH_LEAD = 0.1
+REFRESH_JITTER = 0.1
+# Seconds before a failed refresh is tried again, or an entry that was not cached yet is looked at again
+RETRY_DELAY = 30
+# Most recent freshness ages and refresh lags kept for metrics()
+METRIC_SAMPLES = 1000
+# Longest the scheduler thread sleeps between passes
+MAX_SLEEP = 60
+
+
+def percentile(samples, q):
+    """
+    Nearest-rank percentile of samples, or None if there are none
+
+    :param q: percentile between 0 and 100
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class refreshScheduler:
+    """
+    Keeps the api_cache entries of recently requested locations fresh from a daemon thread
+    """
+
+    def __init__(self, track_window, units="imperial", time_step="1h", time_periods=("now", "forecast"),
+                 max_per_hour=MAX_REFRESH_PER_HOUR, max_locations=MAX_LOCATIONS):
+        """
+        :param track_window: seconds a location keeps being refreshed after its last request
+        :param units: units of the responses to refresh, as passed to api_call
+        :param time_step: time step of the responses to refresh, as passed to api_call
+        :param time_periods: responses refreshed for every location
+        :param max_per_hour: refresh budget; 0 disables refreshing but keeps the freshness metrics
+        :param max_locations: maximum number of tracked locations
+        """
+        self.track_window = track_window
+        self.units = units
+        self.time_step = time_step
+        self.time_periods = time_periods
+        self.max_per_hour = max_per_hour
+        self.max_locations = max_locations
+
+        self._locations = OrderedDict()  # zipcode -> (weatherloc, time of last request)
+        self._due = {}  # (zipcode, time_period) -> (monotonic time the refresh is due, expiry of the entry)
+        self._tokens = REFRESH_BURST
+        self._tokens_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pid = None
+
+        self.stats = {"refreshes": 0, "failures": 0, "deferred": 0, "late": 0, "dropped": 0,
+                      "served_fresh": 0, "served_stale": 0, "served_cold": 0}
+        self.freshness_ages = deque(maxlen=METRIC_SAMPLES)
+        self.refresh_lags = deque(maxlen=METRIC_SAMPLES)
+
+    def touch(self, wlo):
+        """
+        Records a request for a location: it is refreshed for the next track_window seconds, and the age of its
+        cached responses is recorded as the freshness the visitor is about to get. Starts the thread if needed.
+
+        :type wlo: weatherloc
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._locations[wlo.zipcode] = (wlo, now)
+            self._locations.move_to_end(wlo.zipcode)
+            while len(self._locations) > self.max_locations:
+                self._forget(next(iter(self._locations)))
+
+            for time_period in self.time_periods:
+                key = self._key(time_period, wlo)
+                age, expires_at = api_cache.age(key), api_cache.expires_at(key)
+                if age is None:
+                    self.stats["served_cold"] += 1
+                    continue
+                self.freshness_ages.append(age)
+                self.stats["served_fresh" if expires_at > now else "served_stale"] += 1
+
+        self.start()
+        self._wake.set()
+
+    def run_pending(self):
+        """
+        Runs one scheduling pass on the calling thread: drops locations past their tracking window and refreshes the
+        entries that are due, earliest first, while the budget allows
+
+        :return: seconds until the next refresh is due
+        """
+        now = time.monotonic()
+        with self._lock:
+            for zipcode, (_, requested_at) in list(self._locations.items()):
+                if now - requested_at > self.track_window:
+                    self._forget(zipcode)
+            tasks = [(self._schedule(zipcode, time_period, wlo, now), zipcode, time_period, wlo)
+                     for zipcode, (wlo, _) in self._locations.items() for time_period in self.time_periods]
+
+        # touch() runs before the visitor's own fetch, so entries that were not cached yet are looked at again soon
+        next_due = now + (RETRY_DELAY if any(task[0] is None for task in tasks) else MAX_SLEEP)
+        for (due, expires_at), zipcode, time_period, wlo in sorted((task for task in tasks if task[0] is not None),
+                                                                  key=lambda task: task[0][0]):
+            now = time.monotonic()
+            if due > now:
+                next_due = min(next_due, due)
+                break
+            if not self._take_token(now):
+                self.stats["deferred"] += 1
+                next_due = now + self._token_wait()
+                break
+            self._refresh(zipcode, time_period, wlo, due, expires_at)
+        return max(next_due - time.monotonic(), 0)
+
+    def metrics(self):
+        """
+        :return: dict of the refresh counters, the number of tracked locations and the median, 95th percentile and
+            maximum of the freshness age of served responses and of the refresh lag, in seconds. The lag is how
+            late a refresh finished compared to when it was due; it grows when the budget is exhausted.
+        """
+        metrics = dict(self.stats, tracked=len(self._locations))
+        for name, samples in (("freshness_age", list(self.freshness_ages)), ("refresh_lag", list(self.refresh_lags))):
+            metrics[f"{name}_p50"] = percentile(samples, 50)
+            metrics[f"{name}_p95"] = percentile(samples, 95)
+            metrics[f"{name}_max"] = max(samples, default=None)
+        return metrics
+
+    def start(self):
+        """
+        Starts the scheduler thread unless it already runs in this process
+        """
+        if self.max_per_hour <= 0 or self._stopped:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="weather-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                delay = self.run_pending()
+            except Exception as e:
+                print(f"Refresh pass failed: {e}")
+                delay = MAX_SLEEP
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def _key(self, time_period, wlo):
+        return build_request(time_period, self.time_step, self.units, wlo)[1]
+
+    def _schedule(self, zipcode, time_period, wlo, now):
+        """
+        Returns (due time, expiry) of the next refresh of an entry, or None if it is not cached. A jittered due time
+        is picked whenever the entry was stored again since the last pass; lock held
+        """
+        key = self._key(time_period, wlo)
+        expires_at = api_cache.expires_at(key)
+        if expires_at is None:
+            # Not cached (yet, or any more): the next request fetches it
+            self._due.pop((zipcode, time_period), None)
+            return None
+
+        scheduled = self._due.get((zipcode, time_period))
+        if scheduled is None or scheduled[1] != expires_at:
+            stored_at = now - api_cache.age(key)
+            ttl = expires_at - stored_at
+            due = expires_at - ttl * (REFRESH_LEAD + random.uniform(0, REFRESH_JITTER))
+            scheduled = self._due[(zipcode, time_period)] = (due, expires_at)
+        return scheduled
+
+    def _refresh(self, zipcode, time_period, wlo, due, expires_at):
+        try:
+            response = api_refresh(time_period=time_period, time_step=self.time_step, units=self.units, wlo=wlo)
+            ok = response.ok
+        except Exception as e:
+            print(f"Refreshing {time_period} for {zipcode} failed: {e}")
+            ok = False
+
+        finished = time.monotonic()
+        with self._lock:
+            if ok:
+                self.stats["refreshes"] += 1
+                self.stats["late"] += finished > expires_at
+                self.refresh_lags.append(max(finished - due, 0))
+            else:
+                self.stats["failures"] += 1
+                # The old entry is still cached, so without this the next pass would retry immediately
+                if (zipcode, time_period) in self._due:
+                    self._due[(zipcode, time_period)] = (finished + RETRY_DELAY, expires_at)
+
+    def _take_token(self, now):
+        with self._lock:
+            self._tokens = min(REFRESH_BURST, self._tokens + (now - self._tokens_at) * self.max_per_hour / 3600)
+            self._tokens_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _token_wait(self):
+        return (1 - self._tokens) * 3600 / self.max_per_hour
+
+    def _forget(self, zipcode):
+        del self._locations[zipcode]
+        for time_period in self.time_periods:
+            self._due.pop((zipcode, time_period), None)
+        self.stats["dropped"] += 1
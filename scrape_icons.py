@@ -1,23 +1,106 @@
-from typing import Any
+"""
+Downloads the Tomorrow.io weather icons and builds icons.bundle.
 
-import requests
+    python scrape_icons.py                        # fetch from Github
+    python scrape_icons.py --source ./mirror      # build from a local directory of PNGs, fully offline
+
+Downloads run on a bounded thread pool into a cache directory. Each file's ETag/Last-Modified is kept in a
+manifest so reruns only re-download icons that changed, and a run that fails part way resumes from the
+files it already has. Every file, the manifest and the bundle are written atomically.
+"""
+import argparse
+import io
 import json
-import pickle
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import formatdate
+
+import requests
+
+import transport
+from icon_bundle import write_bundle
 
 ICONS_URL = "https://github.com/Tomorrow-IO-API/tomorrow-weather-codes/raw/51b9588fa598d7a8fcf26798854e0d74708abcc4/V2_icons/large/png/"
+ICONS_LISTING_URL = ("https://github.com/Tomorrow-IO-API/tomorrow-weather-codes/tree"
+                     "/51b9588fa598d7a8fcf26798854e0d74708abcc4/V2_icons/large/png")
+
+CACHE_DIR = ".icon_cache"
+MANIFEST = "manifest.json"
+MAX_WORKERS = 8
+
+# Pre-resized variants generated from the @2x originals, e.g. 10000_clear_32px.png, so figures that show icons
+# at ~30 px don't ship 144 px images
+VARIANT_SIZES = (32, 64)
+VARIANT_FORMATS = ("png", "webp")
+
+
+def write_atomic(path, data):
+    """
+    Writes bytes to path through a temporary file, so an interrupted run never leaves a truncated file
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
 
+def is_local(source):
+    return os.path.isdir(source)
 
-def get_github_file_content(url):
-    response = requests.get(url)
+
+def get_github_file_content(url, validators=None):
+    """
+    Downloads a file, sending If-None-Match/If-Modified-Since when validators from an earlier download are given
+
+    :param url: file url
+    :param validators: dict with the "etag" and/or "last_modified" of the cached copy
+    :return: (content or None if unchanged, new validators), or (None, None) on failure
+    """
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    try:
+        response = transport.get(url, headers=headers)
+    except requests.RequestException as e:
+        # Raised once the transport's retries are exhausted, e.g. timeouts and connection errors
+        print(f"Failed to download: {url} ({e})")
+        return None, None
+    if response.status_code == 304:
+        return None, validators
     if response.status_code == 200:
-        return response.content
-    else:
-        print(f"Failed to download: {url}")
-        return None
+        return response.content, {"etag": response.headers.get("ETag"),
+                                  "last_modified": response.headers.get("Last-Modified")}
+    print(f"Failed to download: {url}")
+    return None, None
+
+
+def get_local_file_content(path, validators=None):
+    """
+    Local mirror counterpart of get_github_file_content, using the file's mtime as Last-Modified
+    """
+    try:
+        last_modified = formatdate(os.path.getmtime(path), usegmt=True)
+        if validators and validators.get("last_modified") == last_modified:
+            return None, validators
+        with open(path, "rb") as f:
+            return f.read(), {"etag": None, "last_modified": last_modified}
+    except OSError as e:
+        print(f"Failed to read: {path} ({e})")
+        return None, None
 
 
 def get_github_files(permalink):
-    response = requests.get(permalink)
+    try:
+        response = transport.get(permalink)
+    except requests.RequestException as e:
+        print(f"Error: Unable to fetch data from the GitHub API ({e})")
+        return []
 
     if response.status_code == 200:
 
@@ -34,21 +117,150 @@ def get_github_files(permalink):
         return []
 
 
-github_file_names: list[Any] = get_github_files("https://github.com/Tomorrow-IO-API/tomorrow-weather-codes/tree"
-                                                "/51b9588fa598d7a8fcf26798854e0d74708abcc4/V2_icons/large/png")
+def list_icons(source, listing_url=ICONS_LISTING_URL):
+    """
+    Names of the PNG icons available from a url prefix (listed through the Github tree page) or a local directory
+    """
+    if is_local(source):
+        return sorted(name for name in os.listdir(source) if name.endswith(".png"))
+    return get_github_files(listing_url)
+
+
+def load_manifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def download_icons(filenames, source=ICONS_URL, cache_dir=CACHE_DIR, max_workers=MAX_WORKERS):
+    """
+    Brings the cache directory up to date with the source. Files already cached are revalidated with
+    conditional requests; the manifest is saved after every file so an interrupted run resumes where it stopped.
+
+    :param filenames: icon file names to fetch
+    :param source: url prefix or local mirror directory
+    :param cache_dir: directory holding the downloaded files and their manifest
+    :param max_workers: size of the download thread pool
+    :return: (names downloaded or changed, names that failed)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = load_manifest(cache_dir)
+    lock = threading.Lock()
+
+    def fetch(filename):
+        cached = os.path.exists(os.path.join(cache_dir, filename))
+        validators = manifest.get(filename) if cached else None
+        if is_local(source):
+            content, new_validators = get_local_file_content(os.path.join(source, filename), validators)
+        else:
+            content, new_validators = get_github_file_content(source + filename, validators)
+
+        if new_validators is None:
+            return filename, False, False
+        if content is not None:
+            write_atomic(os.path.join(cache_dir, filename), content)
+        with lock:
+            manifest[filename] = new_validators
+            write_atomic(os.path.join(cache_dir, MANIFEST), json.dumps(manifest, indent=1).encode())
+        return filename, True, content is not None
+
+    changed, failed = [], []
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="icon-download") as executor:
+        for future in as_completed([executor.submit(fetch, filename) for filename in filenames]):
+            filename, ok, downloaded = future.result()
+            if not ok:
+                failed.append(filename)
+            elif downloaded:
+                changed.append(filename)
+    return changed, failed
+
+
+def bundle_is_current(output, cache_dir, filenames):
+    """
+    Whether the bundle was written after every cached icon in filenames, so it holds their current bytes. Judged
+    from the files rather than from what this run downloaded, since a resumed run may find nothing new to download
+    after an earlier run updated the cache but failed before writing the bundle.
+    """
+    try:
+        built_at = os.path.getmtime(output)
+        return all(os.path.getmtime(os.path.join(cache_dir, filename)) <= built_at for filename in filenames)
+    except OSError:
+        return False
+
+
+def build_icon_variants(png_files, sizes=VARIANT_SIZES, formats=VARIANT_FORMATS):
+    """
+    Downscales every @2x icon to each size and saves it optimized in each format (requires Pillow)
+
+    :param png_files: dictionary of icon file name -> PNG bytes
+    :param sizes: square sizes in pixels
+    :param formats: "png" and/or "webp"
+    :return: dictionary of variant file name -> image bytes
+    """
+    from PIL import Image
+
+    variants = {}
+    for name, content in png_files.items():
+        match = re.match(r"^(\d+_.*)_large@2x\.png$", name)
+        if not match:
+            continue
+
+        image = Image.open(io.BytesIO(content))
+        for size in sizes:
+            resized = image.resize((size, size), Image.LANCZOS)
+            for fmt in formats:
+                buf = io.BytesIO()
+                if fmt == "webp":
+                    resized.save(buf, format="WEBP", quality=90, method=6)
+                else:
+                    resized.save(buf, format="PNG", optimize=True)
+                variants[f"{match.group(1)}_{size}px.{fmt}"] = buf.getvalue()
+    return variants
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download the weather icons and build the icon bundle")
+    parser.add_argument("--source", default=ICONS_URL, help="icon url prefix, or a local mirror directory")
+    parser.add_argument("--listing", default=ICONS_LISTING_URL, help="Github tree page listing the icons")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--output", default="icons.bundle")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(VARIANT_SIZES))
+    parser.add_argument("--formats", nargs="*", default=list(VARIANT_FORMATS))
+    parser.add_argument("--force", action="store_true", help="rebuild the bundle even if no icon changed")
+    args = parser.parse_args(argv)
+
+    filenames = list_icons(args.source, args.listing)
+    if not filenames:
+        print("No icons to download")
+        return 1
+
+    changed, failed = download_icons(filenames, args.source, args.cache_dir, args.workers)
+    print(f"{len(filenames)} icons: {len(changed)} downloaded, {len(filenames) - len(changed) - len(failed)} "
+          f"unchanged, {len(failed)} failed")
+    if failed:
+        # The manifest already records everything that succeeded, so rerunning only retries these
+        print("Not writing the bundle; rerun to resume: " + ", ".join(sorted(failed)))
+        return 1
+    if not args.force and bundle_is_current(args.output, args.cache_dir, filenames):
+        print(f"{args.output} is up to date")
+        return 0
+
+    # Dictionary to store file content (binary)
+    png_files = {}
+    for filename in filenames:
+        with open(os.path.join(args.cache_dir, filename), "rb") as f:
+            png_files[filename] = f.read()
 
-# Dictionary to store file content (binary)
-png_files = {}
+    png_files.update(build_icon_variants(png_files, args.sizes, args.formats))
 
-# List of filenames you want to download
-filenames = github_file_names
+    # Identical images are deduplicated by content hash when the bundle is written
+    write_bundle(args.output, png_files)
+    print(f"Wrote {len(png_files)} icons to {args.output}")
+    return 0
 
-# Download each file and store content in the dictionary
-for filename in filenames:
-    url = ICONS_URL + filename
-    content = get_github_file_content(url)
-    if content:
-        png_files[filename] = content
 
-with open('data.pkl', 'wb') as f:
-    pickle.dump(png_files, f)
+if __name__ == '__main__':
+    raise SystemExit(main())
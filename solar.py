@@ -0,0 +1,104 @@
+"""
+Sunrise and sunset times from the NOAA solar position algorithm, vectorized over dates.
+Equations follow the NOAA Global Monitoring Laboratory solar calculator spreadsheet:
+https://gml.noaa.gov/grad/solcalc/calcdetails.html
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Solar zenith angle at sunrise/sunset, accounting for refraction and the solar disc radius
+SUNRISE_ZENITH = 90.833
+
+# Coordinates are rounded before caching so nearby locations share entries (2 digits ~ 1 km, a few seconds of sun)
+ROUND_DIGITS = 2
+CACHE_SIZE = 4096
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def sunrise_sunset(lat, lng, dates):
+    """
+    Computes sunrise and sunset for a location on each of the given dates in a single vectorized pass
+
+    :param lat: latitude in degrees
+    :param lng: longitude in degrees, east positive
+    :param dates: array-like of calendar dates
+    :return: (sunrise, sunset) as datetime64[s] arrays in UTC; polar night yields sunrise == sunset at solar noon
+             and polar day spans the full 24 hours around it
+    """
+    days = np.asarray(dates, dtype="datetime64[D]")
+
+    # Julian day of the approximate local solar noon, in Julian centuries since J2000
+    jd = days.astype(np.float64) + 2440587.5 + 0.5 - lng / 360.
+    t = (jd - 2451545.) / 36525.
+
+    mean_long = np.radians((280.46646 + t * (36000.76983 + t * 0.0003032)) % 360)
+    mean_anom = np.radians(357.52911 + t * (35999.05029 - 0.0001537 * t))
+    eccent = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+
+    center = (np.sin(mean_anom) * (1.914602 - t * (0.004817 + 0.000014 * t))
+              + np.sin(2 * mean_anom) * (0.019993 - 0.000101 * t)
+              + np.sin(3 * mean_anom) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * t)
+    app_long = np.radians(np.degrees(mean_long) + center - 0.00569 - 0.00478 * np.sin(omega))
+
+    mean_obliq = 23 + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+    obliq = np.radians(mean_obliq + 0.00256 * np.cos(omega))
+    decl = np.arcsin(np.sin(obliq) * np.sin(app_long))
+
+    # Equation of time, in minutes
+    y = np.tan(obliq / 2) ** 2
+    eq_time = 4 * np.degrees(y * np.sin(2 * mean_long)
+                             - 2 * eccent * np.sin(mean_anom)
+                             + 4 * eccent * y * np.sin(mean_anom) * np.cos(2 * mean_long)
+                             - 0.5 * y * y * np.sin(4 * mean_long)
+                             - 1.25 * eccent * eccent * np.sin(2 * mean_anom))
+
+    # Hour angle of sunrise; clipping turns polar night into a zero-length day and polar day into 24 hours
+    phi = np.radians(lat)
+    cos_ha = np.cos(np.radians(SUNRISE_ZENITH)) / (np.cos(phi) * np.cos(decl)) - np.tan(phi) * np.tan(decl)
+    hour_angle = np.degrees(np.arccos(np.clip(cos_ha, -1, 1)))
+
+    solar_noon = 720 - 4 * lng - eq_time
+    midnight = days.astype("datetime64[s]")
+    sunrise = midnight + np.round((solar_noon - 4 * hour_angle) * 60).astype("timedelta64[s]")
+    sunset = midnight + np.round((solar_noon + 4 * hour_angle) * 60).astype("timedelta64[s]")
+
+    return sunrise, sunset
+
+
+def get_sun_times(lat, lng, dates):
+    """
+    Cached sunrise and sunset lookup, keyed by (rounded lat, rounded lng, date). Only the dates missing from
+    the cache are computed, in one vectorized call.
+
+    :param lat: latitude in degrees
+    :param lng: longitude in degrees
+    :param dates: array-like of calendar dates
+    :return: (sunrise, sunset) as datetime64[s] arrays in UTC, aligned with dates
+    """
+    lat, lng = round(float(lat), ROUND_DIGITS), round(float(lng), ROUND_DIGITS)
+    days = np.asarray(dates, dtype="datetime64[D]")
+    keys = [(lat, lng, day) for day in days.tolist()]
+
+    with _cache_lock:
+        found = {key: _cache[key] for key in dict.fromkeys(keys) if key in _cache}
+        for key in found:
+            _cache.move_to_end(key)
+
+    missing = [key for key in dict.fromkeys(keys) if key not in found]
+    if missing:
+        sunrise, sunset = sunrise_sunset(lat, lng, [key[2] for key in missing])
+        computed = dict(zip(missing, zip(sunrise, sunset)))
+        found.update(computed)
+        with _cache_lock:
+            _cache.update(computed)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    sunrise = np.array([found[key][0] for key in keys], dtype="datetime64[s]")
+    sunset = np.array([found[key][1] for key in keys], dtype="datetime64[s]")
+    return sunrise, sunset
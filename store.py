@@ -0,0 +1,32 @@
+"""
+Per-thread SQLite connections for the on-disk stores shared by every worker process (locations.db,
+recommendations.db).
+"""
+import os
+import sqlite3
+import threading
+
+_db_local = threading.local()
+
+
+def get_db(path, schema):
+    """
+    Returns this thread's connection to the SQLite file at path, creating its tables on first use
+
+    :param path: SQLite file
+    :param schema: CREATE TABLE IF NOT EXISTS statement run when the connection is opened
+    :return: sqlite3.Connection
+    """
+    conns = getattr(_db_local, "conns", None)
+    # SQLite connections must not be used across fork, e.g. in workers forked by gunicorn --preload
+    if conns is None or _db_local.pid != os.getpid():
+        conns = _db_local.conns = {}
+        _db_local.pid = os.getpid()
+    conn = conns.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30)
+        # WAL lets several workers read while one of them writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(schema)
+        conns[path] = conn
+    return conn
@@ -0,0 +1,112 @@
+"""
+Shared HTTP transport for every outbound call (Tomorrow.io, sunrise-sunset.org, GitHub icons).
+One pooled, keep-alive session per process with timeouts and bounded retries, plus per-host latency histograms.
+"""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import InvalidHeader, MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+POOL_SIZE = int(os.environ.get("WEATHER_HTTP_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.environ.get("WEATHER_HTTP_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.environ.get("WEATHER_HTTP_READ_TIMEOUT", "10"))
+MAX_RETRIES = int(os.environ.get("WEATHER_HTTP_MAX_RETRIES", "3"))
+# Retries wait backoff * 2 ** (attempt - 1) seconds, capped, unless a 429/503 carries a Retry-After header
+BACKOFF_FACTOR = 0.5
+BACKOFF_MAX = 8
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Longest Retry-After honoured; a response asking for more is returned as is instead of being retried, since the
+# calling thread, and every caller waiting on the same api_cache key, would sleep for all of it
+RETRY_AFTER_MAX = 5
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket catches everything slower
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+latency_histograms = {}
+_histogram_lock = threading.Lock()
+
+
+class boundedRetry(Retry):
+    """
+    Retry that gives up and returns the response when its Retry-After exceeds RETRY_AFTER_MAX
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and self.respect_retry_after_header:
+            try:
+                too_long = self.parse_retry_after(retry_after) > RETRY_AFTER_MAX
+            except InvalidHeader:
+                too_long = False
+            if too_long:
+                # With raise_on_status=False the pool returns the response it was given
+                raise MaxRetryError(_pool, url, ResponseError(f"Retry-After {retry_after} exceeds {RETRY_AFTER_MAX} s"))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def _build_session():
+    retry = boundedRetry(total=MAX_RETRIES, connect=MAX_RETRIES, read=MAX_RETRIES, status=MAX_RETRIES,
+                  backoff_factor=BACKOFF_FACTOR, backoff_max=BACKOFF_MAX, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=frozenset(["GET", "HEAD"]), respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session():
+    """
+    Returns this process's pooled session. A forked worker gets its own session instead of sharing sockets
+    with its parent.
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = _build_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def record_latency(host, seconds):
+    """
+    Adds one observation to the latency histogram of a host
+    """
+    with _histogram_lock:
+        hist = latency_histograms.get(host)
+        if hist is None:
+            hist = latency_histograms[host] = {"buckets": [0] * len(LATENCY_BUCKETS), "count": 0, "sum": 0.}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                hist["buckets"][i] += 1
+                break
+        hist["count"] += 1
+        hist["sum"] += seconds
+
+
+def get(url, timeout=None, **kwargs):
+    """
+    GET through the shared session with default connect/read timeouts; latency including retries is recorded
+    against the url's host
+
+    :param url: url to fetch
+    :param timeout: (connect, read) timeout in seconds, defaults to CONNECT_TIMEOUT and READ_TIMEOUT
+    :return: requests.Response
+    """
+    start = time.perf_counter()
+    try:
+        return get_session().get(url, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs)
+    finally:
+        record_latency(urlsplit(url).netloc, time.perf_counter() - start)